@@ -1,12 +1,9 @@
-from wrf_fvcom.perturb import (
-    parameter_dict_to_perturbation_vector,
-    transform_perturbation_matrix,
-)
+from wrf_fvcom.perturb import PerturbationEncoder
 from surrogate.utils import surrogate_model_predict
 from sklearn.metrics import r2_score
 from skopt import gp_minimize
 from skopt.utils import use_named_args
-from numpy import isnan
+from numpy import isnan, zeros
 
 
 def gamma2_score(obs, model):
@@ -24,13 +21,17 @@ def run_bayesian_optimization(
     n_iterations=50,
 ):
 
-    input_space = transform_perturbation_matrix(perturbation_matrix, output_type='space')
+    # encoder of the parameters, with the scheme names in the perturbation matrix
+    encoder = PerturbationEncoder.from_perturbation_matrix(perturbation_matrix)
+    input_space = encoder.space
+    # reused by every objective call
+    variable_buffer = zeros((1, encoder.number_columns))
 
     @use_named_args(input_space)
     def objective(**params):
         print(params)
 
-        variable_vector = vector_from_parameter_list(params, perturbation_matrix)
+        variable_vector = vector_from_parameter_list(params, encoder, out=variable_buffer)
 
         # predict using our surrogate model
         predicted_data = surrogate_model_predict(surrogate_model, variable_vector).flatten()
@@ -61,7 +62,7 @@ def run_bayesian_optimization(
 
     # retrieve the best prediction
     best_params = dict(zip(posterior_gp.space.dimension_names, posterior_gp.x))
-    variable_vector = vector_from_parameter_list(best_params, perturbation_matrix)
+    variable_vector = vector_from_parameter_list(best_params, encoder)
     best_prediction = surrogate_model_predict(surrogate_model, variable_vector).flatten()
     if pca_obj is not None:
         best_prediction = pca_obj.inverse_transform(best_prediction)
@@ -69,12 +70,8 @@ def run_bayesian_optimization(
     return posterior_gp, best_prediction
 
 
-def vector_from_parameter_list(params, perturbation_matrix):
+def vector_from_parameter_list(params, encoder, out=None):
     # process the parameter inputs for surrogate model entry
-    parameter_vector = parameter_dict_to_perturbation_vector(params)
-    # replace the first matrix entry of the dummy matrix
-    perturbation_matrix[0, :] = parameter_vector.values
-    variable_matrix = transform_perturbation_matrix(perturbation_matrix)
-    variable_vector = variable_matrix.isel(run=0).values.reshape(1, -1)
+    variable_vector = encoder.encode_parameters(params, out=out)
 
     return variable_vector
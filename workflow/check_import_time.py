@@ -0,0 +1,57 @@
+import subprocess
+import sys
+from pathlib import Path
+
+# import-time budget [s] of the modules used by short jobs and worker processes
+IMPORT_BUDGETS = {
+    'wrf_fvcom.variables': 0.05,
+    'wrf_fvcom.perturb': 1.0,
+    'wrf_fvcom.design': 1.0,
+    'wrf_fvcom.scheduler': 1.0,
+    'surrogate.utils': 0.3,
+    'surrogate.kl': 0.3,
+    'surrogate.gsa': 0.3,
+    'preprocessing.timeseries': 1.5,
+}
+
+# heavy dependencies that are only imported when first used
+LAZY_MODULES = ['pint', 'chaospy', 'numpoly', 'sklearn', 'skopt', 'matplotlib', 'torch']
+
+
+def import_time(module: str) -> tuple:
+    """
+    :param module: module to import in a new interpreter
+    :return: cumulative import time [s] of the module, and the lazy modules it imported
+    """
+
+    code = (
+        f'import sys, {module}; '
+        f'print(",".join(name for name in {LAZY_MODULES} if name in sys.modules))'
+    )
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=Path(__file__).parent,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # the last line of the import-time report is the module itself: "self [us] | cumulative [us] | name"
+    report = [line for line in output.stderr.splitlines() if line.startswith('import time:')]
+    cumulative = int(report[-1].split('|')[1])
+    imported = [name for name in output.stdout.strip().split(',') if name]
+    return cumulative * 1e-6, imported
+
+
+if __name__ == '__main__':
+
+    over_budget = False
+    for module, budget in IMPORT_BUDGETS.items():
+        seconds, imported = import_time(module)
+        failed = seconds > budget or len(imported) > 0
+        over_budget |= failed
+        print(
+            f'{"FAIL" if failed else "ok  "} {module}: {seconds:.3f} s (budget {budget} s)'
+            + (f', imports {", ".join(imported)}' if imported else '')
+        )
+
+    sys.exit(1 if over_budget else 0)
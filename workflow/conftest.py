@@ -0,0 +1,2 @@
+# the workflow directory is the import root of the preprocessing, surrogate and wrf_fvcom modules,
+# pytest puts the directory of this file on the path so the tests import them in the same way
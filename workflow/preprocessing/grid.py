@@ -0,0 +1,380 @@
+import os
+import pickle
+import numpy as np
+import xarray as xr
+from hashlib import sha1
+from os import PathLike
+from pathlib import Path
+from typing import Callable
+from scipy.sparse import csr_matrix
+from scipy.spatial import KDTree
+
+# number of coordinate values (per dimension) sampled to make the grid signature
+SIGNATURE_SAMPLES = 1000
+
+# number of nearest FVCOM elements searched for the triangle containing a location
+CANDIDATE_ELEMENTS = 8
+
+# tolerance of the (barycentric or bilinear) coordinates for a location to be inside a cell
+INSIDE_TOLERANCE = 1e-10
+
+# in-memory caches for the current session, keyed by grid signature
+_grid_tree_cache = {}
+_grid_index_cache = {}
+_grid_interpolation_cache = {}
+
+
+def _lazy_coordinates(wfv_temp: xr.Dataset, file_type: str) -> tuple:
+    """
+    :param wfv_temp: Dataset of a "wrf" cstm file or "fvcom" output file opened lazily
+    :param file_type: "wrf" or "fvcom"
+    :return: longitude and latitude DataArrays (not yet read from file)
+    """
+
+    if file_type == 'fvcom':
+        return wfv_temp['lon'], wfv_temp['lat']
+    elif file_type == 'wrf':
+        return wfv_temp['XLONG'].isel(Time=0), wfv_temp['XLAT'].isel(Time=0)
+    else:
+        raise ValueError(f'file_type {file_type} not recognized')
+
+
+def grid_coordinates(fname: PathLike, file_type: str) -> tuple:
+    """
+    :param fname: a "wrf" cstm file or "fvcom" output file
+    :param file_type: "wrf" or "fvcom"
+    :return: flattened longitude and latitude arrays of the grid
+    """
+
+    with xr.open_dataset(fname, decode_times=False, decode_coords=False) as wfv_temp:
+        lon, lat = _lazy_coordinates(wfv_temp, file_type)
+        return lon.values.flatten(), lat.values.flatten()
+
+
+def grid_signature(fname: PathLike, file_type: str) -> str:
+    """
+    :param fname: a "wrf" cstm file or "fvcom" output file
+    :param file_type: "wrf" or "fvcom"
+    :return: signature of the grid made from its shape and a hash of a strided subset of its coordinates
+    """
+
+    with xr.open_dataset(fname, decode_times=False, decode_coords=False) as wfv_temp:
+        lon, lat = _lazy_coordinates(wfv_temp, file_type)
+        shape = lon.shape
+        # only read a strided subset of the coordinates
+        stride = max(1, max(shape) // SIGNATURE_SAMPLES)
+        subset = {dim: slice(None, None, stride) for dim in lon.dims}
+        lon = lon.isel(subset).values
+        lat = lat.isel(subset).values
+
+    coordinate_hash = sha1(np.ascontiguousarray(lon, dtype=float).tobytes())
+    coordinate_hash.update(np.ascontiguousarray(lat, dtype=float).tobytes())
+    shape_string = 'x'.join(str(size) for size in shape)
+
+    return f'{file_type}_{shape_string}_{coordinate_hash.hexdigest()[:16]}'
+
+
+def locations_signature(lons, lats) -> str:
+    """
+    :param lons: list of longitude locations
+    :param lats: list of latitude locations
+    :return: hash of the location coordinates
+    """
+
+    locations = np.c_[np.asarray(lons, dtype=float), np.asarray(lats, dtype=float)]
+    return sha1(np.ascontiguousarray(locations).tobytes()).hexdigest()[:16]
+
+
+def write_cache_file(cache_file: Path, write: Callable):
+    """
+    writes the cache file into a temporary file of the process that then replaces it atomically,
+    so processes building the same cache file at once never read a partly written file
+
+    :param cache_file: file to write
+    :param write: function that writes the contents into the open (binary) file
+    """
+
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    temporary_file = cache_file.with_name(f'{cache_file.name}.{os.getpid()}.tmp')
+    with open(temporary_file, 'wb') as fp:
+        write(fp)
+    os.replace(temporary_file, cache_file)
+
+
+def grid_tree(
+    fname: PathLike, file_type: str, signature: str = None, cache_directory: PathLike = None,
+) -> KDTree:
+    """
+    :param fname: a "wrf" cstm file or "fvcom" output file
+    :param file_type: "wrf" or "fvcom"
+    :param signature: grid signature of the file, computed if None
+    :param cache_directory: directory where the tree is saved to and loaded from, not saved if None
+    :return: KDTree of the (flattened) grid longitude and latitude
+    """
+
+    if signature is None:
+        signature = grid_signature(fname, file_type)
+
+    if signature in _grid_tree_cache:
+        return _grid_tree_cache[signature]
+
+    tree_file = None
+    if cache_directory is not None:
+        tree_file = Path(cache_directory) / f'{signature}_tree.pkl'
+        if tree_file.exists():
+            with open(tree_file, 'rb') as fp:
+                wfv_grid_tree = pickle.load(fp)
+            _grid_tree_cache[signature] = wfv_grid_tree
+            return wfv_grid_tree
+
+    lon, lat = grid_coordinates(fname, file_type)
+    wfv_grid_tree = KDTree(np.c_[lon, lat])
+    _grid_tree_cache[signature] = wfv_grid_tree
+
+    if tree_file is not None:
+        write_cache_file(tree_file, lambda fp: pickle.dump(wfv_grid_tree, fp))
+
+    return wfv_grid_tree
+
+
+def grid_index_at_locations(
+    fname: PathLike, file_type: str, lons, lats, cache_directory: PathLike = None,
+) -> np.ndarray:
+    """
+    :param fname: a "wrf" cstm file or "fvcom" output file
+    :param file_type: "wrf" or "fvcom"
+    :param lons: list of longitude locations
+    :param lats: list of latitude locations
+    :param cache_directory: directory where the tree and indices are saved to and loaded from, not saved if None
+    :return: index of the nearest (flattened) grid node to each location
+    """
+
+    signature = grid_signature(fname, file_type)
+    key = f'{signature}_{locations_signature(lons, lats)}'
+
+    if key in _grid_index_cache:
+        return _grid_index_cache[key]
+
+    index_file = None
+    if cache_directory is not None:
+        index_file = Path(cache_directory) / f'{key}_index.npz'
+        if index_file.exists():
+            wfv_grid_ind = np.load(index_file)['grid_index']
+            _grid_index_cache[key] = wfv_grid_ind
+            return wfv_grid_ind
+
+    wfv_grid_tree = grid_tree(
+        fname, file_type, signature=signature, cache_directory=cache_directory
+    )
+    wfv_d, wfv_grid_ind = wfv_grid_tree.query(np.c_[lons, lats])
+    _grid_index_cache[key] = wfv_grid_ind
+
+    if index_file is not None:
+        write_cache_file(
+            index_file, lambda fp: np.savez(fp, grid_index=wfv_grid_ind, distance=wfv_d)
+        )
+
+    return wfv_grid_ind
+
+
+def grid_interpolation_at_locations(
+    fname: PathLike,
+    file_type: str,
+    lons,
+    lats,
+    method: str = 'linear',
+    cache_directory: PathLike = None,
+) -> tuple:
+    """
+    :param fname: a "wrf" cstm file or "fvcom" output file
+    :param file_type: "wrf" or "fvcom"
+    :param lons: list of longitude locations
+    :param lats: list of latitude locations
+    :param method: "linear" (barycentric on FVCOM triangles, bilinear on the WRF grid) or "nearest"
+    :param cache_directory: directory where the operator is saved to and loaded from, not saved if None
+    :return: sorted index of the (flattened) grid nodes used, and sparse interpolation matrix (location x used node)
+    """
+
+    if method == 'nearest':
+        grid_index = grid_index_at_locations(
+            fname, file_type, lons, lats, cache_directory=cache_directory
+        )
+        return _interpolation_operator(grid_index[:, None], np.ones((len(grid_index), 1)))
+    elif method != 'linear':
+        raise ValueError(f'interpolation method {method} not recognized')
+
+    signature = grid_signature(fname, file_type)
+    key = f'{signature}_{locations_signature(lons, lats)}_{method}'
+
+    if key in _grid_interpolation_cache:
+        return _grid_interpolation_cache[key]
+
+    operator_file = None
+    if cache_directory is not None:
+        operator_file = Path(cache_directory) / f'{key}_interpolation.npz'
+        if operator_file.exists():
+            saved = np.load(operator_file)
+            grid_index = saved['grid_index']
+            operator = csr_matrix(
+                (saved['data'], saved['indices'], saved['indptr']), shape=tuple(saved['shape'])
+            )
+            _grid_interpolation_cache[key] = grid_index, operator
+            return grid_index, operator
+
+    # locations outside of the grid cells fall back to the nearest node
+    nearest_index = grid_index_at_locations(
+        fname, file_type, lons, lats, cache_directory=cache_directory
+    )
+    points = np.c_[np.asarray(lons, dtype=float), np.asarray(lats, dtype=float)]
+    if file_type == 'fvcom':
+        nodes, weights = _barycentric_weights(fname, points, nearest_index)
+    elif file_type == 'wrf':
+        nodes, weights = _bilinear_weights(fname, points, nearest_index)
+    grid_index, operator = _interpolation_operator(nodes, weights)
+    _grid_interpolation_cache[key] = grid_index, operator
+
+    if operator_file is not None:
+        write_cache_file(
+            operator_file,
+            lambda fp: np.savez(
+                fp,
+                grid_index=grid_index,
+                data=operator.data,
+                indices=operator.indices,
+                indptr=operator.indptr,
+                shape=operator.shape,
+            ),
+        )
+
+    return grid_index, operator
+
+
+def _interpolation_operator(nodes: np.ndarray, weights: np.ndarray) -> tuple:
+    """
+    :param nodes: index of the (flattened) grid nodes of each location (location x vertex)
+    :param weights: interpolation weights of the nodes (location x vertex)
+    :return: sorted unique index of the nodes, and sparse interpolation matrix (location x unique node)
+    """
+
+    grid_index, inverse = np.unique(nodes, return_inverse=True)
+    rows = np.repeat(np.arange(nodes.shape[0]), nodes.shape[1])
+    operator = csr_matrix(
+        (weights.ravel(), (rows, inverse.ravel())), shape=(nodes.shape[0], len(grid_index))
+    )
+    operator.eliminate_zeros()
+    return grid_index, operator
+
+
+def _barycentric_weights(fname: PathLike, points: np.ndarray, nearest_index: np.ndarray) -> tuple:
+    """
+    :param fname: an "fvcom" output file
+    :param points: longitude and latitude of the locations (location x 2)
+    :param nearest_index: index of the nearest node to each location
+    :return: nodes of the triangle containing each location and their barycentric weights (location x 3)
+    """
+
+    with xr.open_dataset(fname, decode_times=False, decode_coords=False) as wfv_temp:
+        lon = wfv_temp['lon'].values
+        lat = wfv_temp['lat'].values
+        triangles = wfv_temp['nv'].values.T - 1  # element x 3, zero-based
+        centroids = np.c_[wfv_temp['lonc'].values, wfv_temp['latc'].values]
+
+    # the containing triangle is among the elements with the nearest centroids
+    number_candidates = min(CANDIDATE_ELEMENTS, len(centroids))
+    _, candidates = KDTree(centroids).query(points, k=number_candidates)
+    candidates = candidates.reshape(len(points), number_candidates)
+    vertices = triangles[candidates]  # location x candidate x 3
+    x = lon[vertices]
+    y = lat[vertices]
+    px = points[:, 0, None]
+    py = points[:, 1, None]
+
+    determinant = (y[..., 1] - y[..., 2]) * (x[..., 0] - x[..., 2]) + (x[..., 2] - x[..., 1]) * (
+        y[..., 0] - y[..., 2]
+    )
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weight_a = (
+            (y[..., 1] - y[..., 2]) * (px - x[..., 2]) + (x[..., 2] - x[..., 1]) * (py - y[..., 2])
+        ) / determinant
+        weight_b = (
+            (y[..., 2] - y[..., 0]) * (px - x[..., 2]) + (x[..., 0] - x[..., 2]) * (py - y[..., 2])
+        ) / determinant
+    barycentric = np.stack([weight_a, weight_b, 1 - weight_a - weight_b], axis=-1)
+
+    return _select_cell(vertices, barycentric, nearest_index)
+
+
+def _bilinear_weights(fname: PathLike, points: np.ndarray, nearest_index: np.ndarray) -> tuple:
+    """
+    :param fname: a "wrf" cstm file
+    :param points: longitude and latitude of the locations (location x 2)
+    :param nearest_index: index of the nearest (flattened) grid node to each location
+    :return: nodes of the grid cell containing each location and their bilinear weights (location x 4)
+    """
+
+    with xr.open_dataset(fname, decode_times=False, decode_coords=False) as wfv_temp:
+        lon, lat = _lazy_coordinates(wfv_temp, 'wrf')
+        lon = lon.values
+        lat = lat.values
+    shape = lon.shape
+
+    # the containing cell is one of the four cells around the nearest node
+    row, col = np.unravel_index(nearest_index, shape)
+    offsets = np.array([[0, 0], [-1, 0], [0, -1], [-1, -1]])
+    cell_row = np.clip(row[:, None] + offsets[None, :, 0], 0, shape[0] - 2)
+    cell_col = np.clip(col[:, None] + offsets[None, :, 1], 0, shape[1] - 2)
+    corners = [(0, 0), (0, 1), (1, 0), (1, 1)]
+    vertices = np.stack(
+        [np.ravel_multi_index((cell_row + drow, cell_col + dcol), shape) for drow, dcol in corners],
+        axis=-1,
+    )  # location x candidate x 4
+    p00, p10, p01, p11 = [
+        np.stack([lon.ravel()[vertices[..., vdx]], lat.ravel()[vertices[..., vdx]]], axis=-1)
+        for vdx in range(4)
+    ]
+    point = points[:, None, :]
+
+    # invert the bilinear map of each candidate cell with Newton iterations
+    s = np.full(vertices.shape[0:2], 0.5)
+    t = np.full(vertices.shape[0:2], 0.5)
+    for _ in range(10):
+        residual = (
+            ((1 - s) * (1 - t))[..., None] * p00
+            + (s * (1 - t))[..., None] * p10
+            + ((1 - s) * t)[..., None] * p01
+            + (s * t)[..., None] * p11
+            - point
+        )
+        d_ds = (1 - t)[..., None] * (p10 - p00) + t[..., None] * (p11 - p01)
+        d_dt = (1 - s)[..., None] * (p01 - p00) + s[..., None] * (p11 - p10)
+        determinant = d_ds[..., 0] * d_dt[..., 1] - d_ds[..., 1] * d_dt[..., 0]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            step_s = (d_dt[..., 1] * residual[..., 0] - d_dt[..., 0] * residual[..., 1]) / determinant
+            step_t = (d_ds[..., 0] * residual[..., 1] - d_ds[..., 1] * residual[..., 0]) / determinant
+        s = s - step_s
+        t = t - step_t
+    bilinear = np.stack([(1 - s) * (1 - t), s * (1 - t), (1 - s) * t, s * t], axis=-1)
+
+    return _select_cell(vertices, bilinear, nearest_index)
+
+
+def _select_cell(vertices: np.ndarray, weights: np.ndarray, nearest_index: np.ndarray) -> tuple:
+    """
+    :param vertices: nodes of the candidate cells (location x candidate x vertex)
+    :param weights: interpolation weights in the candidate cells (location x candidate x vertex)
+    :param nearest_index: index of the nearest node, used where no candidate cell contains the location
+    :return: nodes and weights of the first candidate cell containing each location (location x vertex)
+    """
+
+    inside = np.all(weights >= -INSIDE_TOLERANCE, axis=-1)
+    found = inside.any(axis=1)
+    first = inside.argmax(axis=1)
+    locations = np.arange(vertices.shape[0])
+    nodes = vertices[locations, first]
+    weights = weights[locations, first]
+
+    nodes[~found] = nearest_index[~found, None]
+    weights[~found] = 0.0
+    weights[~found, 0] = 1.0
+
+    return nodes, weights
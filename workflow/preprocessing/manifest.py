@@ -0,0 +1,186 @@
+import json
+import os
+import numpy as np
+from hashlib import sha1
+from os import PathLike
+from pathlib import Path
+from typing import List
+
+# number of processed files between writes of the manifest and a new output segment
+CHECKPOINT_FILES = 24
+
+
+class RunManifest:
+    """
+    Manifest of the files of one model run that have already been processed, with
+    their size, modification time and last timestamp, and the output rows they made.
+    The output rows are appended to the run directory as numbered segments, so an
+    interrupted or extended run only processes the files that are new (or changed).
+
+    Files are grouped: a group (e.g., the 24 hourly WRF files of a day) is only
+    recorded once its last file is processed, so processing resumes at the start of
+    the first group that is not complete.
+    """
+
+    def __init__(
+        self,
+        resume_directory: PathLike,
+        file_list: List,
+        settings: dict,
+        checkpoint_files: int = CHECKPOINT_FILES,
+        run_id: str = None,
+    ):
+        """
+        :param resume_directory: directory containing the manifests of all the model runs
+        :param file_list: list of files for the model run
+        :param settings: extraction settings, an existing manifest with other settings is discarded
+        :param checkpoint_files: number of processed files between checkpoints
+        :param run_id: unique name of the model run, the run is named by its first file if None
+        """
+
+        # one manifest per model run and extraction settings: the first file of a run stays the
+        # same when files are appended, and runs with files in the same directory differ in it
+        if run_id is None:
+            run_id = Path(file_list[0]).resolve()
+        run_key = sha1(str(run_id).encode())
+        run_key.update(json.dumps(settings, sort_keys=True).encode())
+        run_key = run_key.hexdigest()[:16]
+        self.directory = Path(resume_directory) / f'run_{run_key}'
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.manifest_file = self.directory / 'manifest.json'
+        self.settings = settings
+        self.checkpoint_files = checkpoint_files
+
+        self._manifest = {'settings': settings, 'files': [], 'segments': []}
+        self._pending_files = []
+        self._pending_rows = []
+
+        if self.manifest_file.exists():
+            with open(self.manifest_file) as fp:
+                manifest = json.load(fp)
+            if manifest['settings'] == settings:
+                self._manifest = manifest
+                self._truncate(self._number_valid(file_list))
+            else:
+                print(f'extraction settings changed, discarding {self.manifest_file}')
+                self._write_manifest()
+
+    @property
+    def number_processed(self) -> int:
+        """number of leading files of the run that do not need to be processed again"""
+        return len(self._manifest['files'])
+
+    def append(self, fname: str, rows: dict = None, last_time=None, end_of_group: bool = True):
+        """
+        :param fname: file that was just processed
+        :param rows: dictionary of the output arrays (with the same number of rows) made by the file
+        :param last_time: last timestamp in the file
+        :param end_of_group: the file completes its group of files
+        """
+
+        stat = os.stat(fname)
+        self._pending_files.append(
+            {
+                'name': str(fname),
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'last_time': None if last_time is None else str(np.datetime64(last_time, 's')),
+                'rows': 0 if rows is None else len(next(iter(rows.values()))),
+                'end_of_group': end_of_group,
+            }
+        )
+        if rows is not None:
+            self._pending_rows.append(rows)
+
+        if end_of_group and len(self._pending_files) >= self.checkpoint_files:
+            self.flush()
+
+    def flush(self):
+        """writes the output rows of the complete groups of processed files and updates the manifest"""
+
+        group_ends = [fdx for fdx, file in enumerate(self._pending_files) if file['end_of_group']]
+        if len(group_ends) == 0:
+            return
+        number_files = group_ends[-1] + 1
+        number_rows = sum(file['rows'] for file in self._pending_files[:number_files])
+        if number_rows > 0:
+            # rows only come from files that end a group so all pending rows are complete
+            self._write_segment(
+                {
+                    key: np.concatenate([rows[key] for rows in self._pending_rows])
+                    for key in self._pending_rows[0]
+                }
+            )
+            self._pending_rows = []
+        self._manifest['files'] += self._pending_files[:number_files]
+        self._pending_files = self._pending_files[number_files:]
+        self._write_manifest()
+
+    def load(self) -> dict:
+        """
+        :return: dictionary of the output arrays of all the recorded files (None if no rows)
+        """
+
+        segments = [
+            np.load(self.directory / segment['name']) for segment in self._manifest['segments']
+        ]
+        if len(segments) == 0:
+            return None
+        return {key: np.concatenate([segment[key] for segment in segments]) for key in segments[0]}
+
+    def _number_valid(self, file_list: List) -> int:
+        """
+        :param file_list: list of files for the model run
+        :return: number of leading files in the manifest that are unchanged in file_list
+        """
+
+        for fdx, file in enumerate(self._manifest['files']):
+            if fdx >= len(file_list) or str(file_list[fdx]) != file['name']:
+                return fdx
+            try:
+                stat = os.stat(file_list[fdx])
+            except FileNotFoundError:
+                return fdx
+            if stat.st_size != file['size'] or stat.st_mtime != file['mtime']:
+                return fdx
+        return len(self._manifest['files'])
+
+    def _truncate(self, number_valid: int):
+        """
+        :param number_valid: number of leading files in the manifest to keep (rounded down to a complete group)
+        """
+
+        files = self._manifest['files']
+        if number_valid == len(files):
+            return
+
+        group_ends = [fdx for fdx, file in enumerate(files[:number_valid]) if file['end_of_group']]
+        number_keep = 0 if len(group_ends) == 0 else group_ends[-1] + 1
+        print(f'{len(files) - number_keep} files changed since {self.manifest_file} was written')
+
+        rows = self.load()
+        number_rows = sum(file['rows'] for file in files[:number_keep])
+        for segment in self._manifest['segments']:
+            (self.directory / segment['name']).unlink()
+        self._manifest['segments'] = []
+        self._manifest['files'] = files[:number_keep]
+        if number_rows > 0:
+            self._write_segment({key: value[:number_rows] for key, value in rows.items()})
+        self._write_manifest()
+
+    def _write_segment(self, rows: dict):
+        """
+        :param rows: dictionary of the output arrays to write into a new segment
+        """
+
+        name = f'segment_{len(self._manifest["segments"]):05d}.npz'
+        np.savez(self.directory / name, **rows)
+        self._manifest['segments'].append({'name': name, 'rows': len(next(iter(rows.values())))})
+
+    def _write_manifest(self):
+        """writes the manifest atomically so an interruption leaves the previous manifest"""
+
+        temporary_file = self.manifest_file.with_suffix('.json.tmp')
+        with open(temporary_file, 'w') as fp:
+            json.dump(self._manifest, fp, indent=1)
+        os.replace(temporary_file, self.manifest_file)
@@ -0,0 +1,213 @@
+import numpy as np
+import xarray as xr
+from hashlib import sha1
+from os import PathLike
+from pathlib import Path
+from scipy.sparse import csr_matrix
+from scipy.spatial import KDTree
+from preprocessing.grid import grid_coordinates, grid_signature, write_cache_file
+
+LAKES = ['Superior', 'Huron', 'Michigan', 'Ontario', 'Erie']
+LAND_ZONES = ['NW', 'NE', 'SW', 'SE']
+
+# maximum distance [degrees] of a WRF cell to the FVCOM nodes of a lake to be in the lake
+LAKE_DISTANCE = 5 / 111
+
+# in-memory cache for the current session, keyed by grid signature
+_region_operator_cache = {}
+
+
+def fvcom_lake_masks(lon: np.ndarray, lat: np.ndarray) -> dict:
+    """
+    :param lon: longitude of the FVCOM nodes (0 to 360)
+    :param lat: latitude of the FVCOM nodes
+    :return: dictionary of the boolean mask of the nodes in each lake
+    """
+
+    superior = (lat > 46.2) & (lon < 275.9)
+    erie = (lat < 43) & (lon > 275)
+    ontario = (lat > 43) & (lat < 44.55) & (lon > 280)
+    michigan = (lat < 46.25) & (lon < 275.25)
+    huron = ~(michigan | superior | erie | ontario) & (lon < 282)
+
+    return {
+        'Superior': superior,
+        'Huron': huron,
+        'Michigan': michigan,
+        'Ontario': ontario,
+        'Erie': erie,
+    }
+
+
+def wrf_region_masks(
+    wrflon: np.ndarray,
+    wrflat: np.ndarray,
+    fvcom_lon: np.ndarray,
+    fvcom_lat: np.ndarray,
+    land_zones: bool = True,
+) -> dict:
+    """
+    :param wrflon: longitude of the WRF cells (0 to 360)
+    :param wrflat: latitude of the WRF cells
+    :param fvcom_lon: longitude of the FVCOM nodes (0 to 360)
+    :param fvcom_lat: latitude of the FVCOM nodes
+    :param land_zones: add the NW, NE, SW and SE zones of the land cells
+    :return: dictionary of the boolean mask of the cells within LAKE_DISTANCE of each lake (and in each land zone)
+    """
+
+    wrf_points = np.c_[wrflon, wrflat]
+    region_masks = {}
+    all_lakes = np.zeros(len(wrf_points), dtype=bool)
+    for lake, lake_mask in fvcom_lake_masks(fvcom_lon, fvcom_lat).items():
+        lake_tree = KDTree(np.c_[fvcom_lon[lake_mask], fvcom_lat[lake_mask]])
+        distance, _ = lake_tree.query(wrf_points)
+        region_masks[lake] = distance < LAKE_DISTANCE
+        all_lakes |= region_masks[lake]
+
+    if land_zones:
+        land = ~all_lakes
+        west = wrflon <= 275
+        north = wrflat > 45
+        region_masks['NW'] = land & west & north
+        region_masks['NE'] = land & ~west & north
+        region_masks['SW'] = land & west & ~north
+        region_masks['SE'] = land & ~west & ~north
+
+    return region_masks
+
+
+def region_operator(region_masks: dict) -> tuple:
+    """
+    :param region_masks: dictionary of the boolean mask (over the flattened grid) of each region
+    :return: region names, and sparse averaging matrix (region x flattened grid node)
+    """
+
+    region_names = list(region_masks)
+    masks = np.stack([np.asarray(region_masks[name]).ravel() for name in region_names])
+    rows, columns = np.nonzero(masks)
+    counts = masks.sum(axis=1)
+    operator = csr_matrix((1.0 / counts[rows], (rows, columns)), shape=masks.shape)
+    return region_names, operator
+
+
+def grid_region_operator(
+    fname: PathLike,
+    file_type: str,
+    fvcom_fname: PathLike = None,
+    land_zones: bool = True,
+    cache_directory: PathLike = None,
+) -> tuple:
+    """
+    :param fname: a "wrf" cstm file or "fvcom" output file
+    :param file_type: "wrf" or "fvcom"
+    :param fvcom_fname: an "fvcom" output file, required to find the lakes on the WRF grid
+    :param land_zones: add the land zones to the WRF regions
+    :param cache_directory: directory where the operator is saved to and loaded from, not saved if None
+    :return: region names, and sparse averaging matrix (region x flattened grid node)
+    """
+
+    signature = grid_signature(fname, file_type)
+    if file_type == 'fvcom':
+        key = f'{signature}_lakes'
+    elif file_type == 'wrf':
+        if fvcom_fname is None:
+            raise ValueError('fvcom_fname is required to find the lakes on the WRF grid')
+        key = f'{signature}_{grid_signature(fvcom_fname, "fvcom")}_lakes'
+        if land_zones:
+            key += '_land'
+    else:
+        raise ValueError(f'file_type {file_type} not recognized')
+
+    if key in _region_operator_cache:
+        return _region_operator_cache[key]
+
+    operator_file = None
+    if cache_directory is not None:
+        operator_file = Path(cache_directory) / f'{key}_regions.npz'
+        if operator_file.exists():
+            saved = np.load(operator_file)
+            operator = csr_matrix(
+                (saved['data'], saved['indices'], saved['indptr']), shape=tuple(saved['shape'])
+            )
+            regions = list(saved['region']), operator
+            _region_operator_cache[key] = regions
+            return regions
+
+    fvcom_lon, fvcom_lat = grid_coordinates(fvcom_fname or fname, 'fvcom')
+    if file_type == 'fvcom':
+        region_masks = fvcom_lake_masks(fvcom_lon, fvcom_lat)
+    elif file_type == 'wrf':
+        wrflon, wrflat = grid_coordinates(fname, 'wrf')
+        region_masks = wrf_region_masks(
+            wrflon + 360, wrflat, fvcom_lon, fvcom_lat, land_zones=land_zones
+        )
+    regions = region_operator(region_masks)
+    _region_operator_cache[key] = regions
+
+    if operator_file is not None:
+        region_names, operator = regions
+        write_cache_file(
+            operator_file,
+            lambda fp: np.savez(
+                fp,
+                region=region_names,
+                data=operator.data,
+                indices=operator.indices,
+                indptr=operator.indptr,
+                shape=operator.shape,
+            ),
+        )
+
+    return regions
+
+
+def regions_signature(regions: tuple) -> str:
+    """
+    :param regions: region names and sparse averaging matrix from grid_region_operator
+    :return: hash of the regions
+    """
+
+    region_names, operator = regions
+    region_hash = sha1(' '.join(region_names).encode())
+    region_hash.update(operator.indptr.tobytes())
+    region_hash.update(operator.indices.tobytes())
+    return region_hash.hexdigest()[:16]
+
+
+def aggregate_regions(values, regions: tuple):
+    """
+    :param values: array or DataArray (e.g., run x time x space), with the grid in the trailing dimensions
+    :param regions: region names and sparse averaging matrix from grid_region_operator
+    :return: region means of values (e.g., run x time x region), NaN for regions without grid nodes
+    """
+
+    region_names, operator = regions
+    number_nodes = operator.shape[1]
+
+    data = np.asarray(values)
+    # the trailing dimensions that make up the (flattened) grid
+    shape = data.shape
+    space_ndim = 0
+    while space_ndim < len(shape) and np.prod(shape[len(shape) - space_ndim : :]) < number_nodes:
+        space_ndim += 1
+    if np.prod(shape[len(shape) - space_ndim : :]) != number_nodes:
+        raise ValueError(
+            f'values with shape {shape} do not end with a grid of {number_nodes} nodes'
+        )
+    leading_shape = shape[0 : len(shape) - space_ndim]
+
+    region_values = operator.dot(data.reshape(-1, number_nodes).T).T
+    region_values = region_values.reshape(leading_shape + (len(region_names),))
+    region_values[..., operator.getnnz(axis=1) == 0] = np.nan
+
+    if not isinstance(values, xr.DataArray):
+        return region_values
+
+    leading_dims = values.dims[0 : len(leading_shape)]
+    coords = {
+        name: coord for name, coord in values.coords.items() if set(coord.dims) <= set(leading_dims)
+    }
+    coords['region'] = region_names
+    return xr.DataArray(
+        data=region_values, coords=coords, dims=leading_dims + ('region',), name=values.name
+    )
@@ -0,0 +1,153 @@
+import numpy as np
+import xarray as xr
+from os import PathLike
+from pathlib import Path
+from typing import List
+
+
+def write_ensemble_store(
+    output_dict: dict,
+    filename: PathLike,
+    variables: List = None,
+    time_chunk: int = 32,
+    complevel: int = 4,
+):
+    """
+    :param output_dict: dictionary of the processed model runs, e.g., {'runs': [...], 'LST': [[time, values], ...], 'T2': [...]}
+    :param filename: name of the netCDF file to write, each variable is written in its own group
+    :param variables: list of variables to write, all variables in output_dict if None
+    :param time_chunk: number of times in each (compressed) chunk
+    :param complevel: zlib compression level
+    """
+
+    if variables is None:
+        variables = [variable for variable in output_dict if variable != 'runs']
+
+    mode = 'w'
+    for variable in variables:
+        run_list = output_dict[variable]
+        runs = output_dict.get('runs', range(len(run_list)))
+        ensemble = ensemble_data_array(run_list, runs, name=variable)
+
+        chunksizes = (1, min(time_chunk, ensemble.sizes['time'])) + ensemble.shape[2::]
+        encoding = {
+            variable: {
+                'zlib': True,
+                'complevel': complevel,
+                'chunksizes': chunksizes,
+                'dtype': ensemble.dtype,
+            }
+        }
+        ensemble.to_dataset().to_netcdf(filename, mode=mode, group=variable, encoding=encoding)
+        print(f'written {variable} with dimensions {dict(ensemble.sizes)} into {filename}')
+        mode = 'a'
+
+
+def ensemble_data_array(run_list: List, runs: List, name: str = None) -> xr.DataArray:
+    """
+    :param run_list: list of [time, values] for each model run, values are DataArray (time, space...) or array (time, location)
+    :param runs: names of the model runs
+    :param name: name of the output DataArray
+    :return: DataArray with dimensions run x time x space, times missing from a run are filled with NaN,
+        and the times of each run marked in its "valid" coordinate (run x time)
+    """
+
+    run_times = [np.asarray(run[0]).astype('datetime64[ns]') for run in run_list]
+    time = np.unique(np.concatenate(run_times))
+
+    template = run_list[0][1]
+    if isinstance(template, xr.DataArray):
+        space_dims = template.dims[1::]
+        # scalar coordinates (e.g., XTIME of the WRF coordinates) only belong to the template run
+        coords = {
+            coord_name: coord
+            for coord_name, coord in template.coords.items()
+            if template.dims[0] not in coord.dims and coord.ndim > 0
+        }
+    else:
+        space_dims = ('location',)
+        coords = {}
+    space_shape = np.shape(template)[1::]
+
+    dtype = np.result_type(*[np.asarray(run[1]).dtype for run in run_list], np.float32)
+    data = np.full((len(run_list), len(time)) + space_shape, np.nan, dtype=dtype)
+    valid = np.zeros((len(run_list), len(time)), dtype=bool)
+    for rdx, (run_time, run) in enumerate(zip(run_times, run_list)):
+        time_index = np.searchsorted(time, run_time)
+        data[rdx, time_index] = np.asarray(run[1])
+        valid[rdx, time_index] = True
+
+    coords.update({'run': list(runs), 'time': time, 'valid': (('run', 'time'), valid)})
+    return xr.DataArray(data=data, coords=coords, dims=('run', 'time') + space_dims, name=name)
+
+
+def read_ensemble_store(
+    filename: PathLike,
+    variable: str,
+    runs: List = None,
+    time_start=None,
+    time_end=None,
+    chunks: dict = None,
+) -> xr.DataArray:
+    """
+    :param filename: name of the netCDF file written by write_ensemble_store
+    :param variable: variable to read, e.g., 'LST' or 'T2'
+    :param runs: names (or integer positions) of the model runs to read, all runs if None
+    :param time_start: first time to read (inclusive), from the start if None
+    :param time_end: last time to read (exclusive), to the end if None
+    :param chunks: dask chunks, otherwise values are only read from file when accessed
+    :return: lazily loaded DataArray (run x time x space) of the selected runs and times
+    """
+
+    if not Path(filename).exists():
+        raise FileNotFoundError(f'{filename} does not exist')
+
+    ensemble = xr.open_dataset(filename, group=variable, chunks=chunks)[variable]
+
+    if runs is not None:
+        if all(isinstance(run, (int, np.integer)) for run in runs):
+            ensemble = ensemble.isel(run=list(runs))
+        else:
+            ensemble = ensemble.sel(run=list(runs))
+
+    time = ensemble['time'].values
+    time_mask = np.ones(time.shape, dtype=bool)
+    if time_start is not None:
+        time_mask &= time >= np.datetime64(time_start)
+    if time_end is not None:
+        time_mask &= time < np.datetime64(time_end)
+    if not time_mask.all():
+        ensemble = ensemble.isel(time=np.flatnonzero(time_mask))
+
+    return ensemble
+
+
+def ensemble_store_to_list(ensemble: xr.DataArray) -> List:
+    """
+    :param ensemble: DataArray (run x time x space) from read_ensemble_store
+    :return: list of [time, values] for each model run, as made by preprocessing.timeseries:
+        values are an array (time x location) for the locations, a DataArray (time x space) otherwise
+    """
+
+    output_list = []
+    for rdx in range(ensemble.sizes['run']):
+        run = ensemble.isel(run=rdx, drop=True).load()
+        space_dims = [dim for dim in run.dims if dim != 'time']
+        # drop the times that were filled for this run
+        if 'valid' in run.coords:
+            valid = run['valid'].values.astype(bool)
+        else:
+            # stores written without the valid times
+            valid = run.notnull().any(dim=space_dims).values
+        run = run.isel(time=np.flatnonzero(valid))
+        run_time = run['time'].values.astype('datetime64[s]')
+        if space_dims == ['location']:
+            output_list.append([run_time, run.values])
+        else:
+            # scalar coordinates of stores written with the coordinates of one time
+            scalar_coords = [name for name, coord in run.coords.items() if coord.ndim == 0]
+            output_list.append(
+                [run_time, run.drop_vars(['time', 'valid'] + scalar_coords, errors='ignore')]
+            )
+
+    return output_list
@@ -1,17 +1,33 @@
 import numpy as np
 import xarray as xr
-from typing import List
+from typing import Callable, List
 from pandas import to_datetime, Timedelta, Timestamp
 from datetime import datetime
-from scipy.spatial import KDTree
 from math import ceil
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from os import PathLike
+from preprocessing.grid import grid_interpolation_at_locations, locations_signature
+from preprocessing.manifest import RunManifest
+from preprocessing.regions import regions_signature
 
 
 K2C = -273.15
 
 
 def extract_timeseries_at_locations(
-    files_lists: List, file_type: str, variable_name: str, lons, lats,
+    files_lists: List,
+    file_type: str,
+    variable_name: str,
+    lons,
+    lats,
+    n_workers: int = 1,
+    grid_cache_directory: PathLike = None,
+    resume_directory: PathLike = None,
+    direct_read: bool = False,
+    interpolation: str = 'nearest',
+    dtype=float,
+    run_ids: List = None,
 ) -> List:
     """
     :param files_lists: list of list of files for each model run
@@ -19,152 +35,715 @@ def extract_timeseries_at_locations(
     :param variable_name: variable name to extract
     :param lons: list of longitude locations
     :param lats: list of latitude locations
+    :param n_workers: number of processes to extract the model runs concurrently (1 = serial)
+    :param grid_cache_directory: directory to save/load the grid index (or interpolation operator) at the locations, not saved if None
+    :param resume_directory: directory of the run manifests, so only new files are extracted on re-invocation, not saved if None
+    :param run_ids: unique name of each model run for its manifest, named by its first file if None
+    :param direct_read: read only the surface layer of the variable at the grid indices of the locations with netCDF4, without decoding the dataset
+    :param interpolation: "nearest" grid node, or "linear" (barycentric on FVCOM triangles, bilinear on the WRF grid)
+    :param dtype: data type of the extracted values, e.g., "float32" to halve the memory
     :return: list of times and variables at the locations for each model run
 
    """
 
     if file_type == 'fvcom':
-        times_per_file = 24
-        vertical_layer = 0
         if variable_name == 'LST':
             variable_name = 'temp'
-    elif file_type == 'wrf':
-        times_per_file = 1
-    else:
+    elif file_type != 'wrf':
         raise ValueError(f'file_type {file_type} not recognized')
 
-    output_list = []
-    for file_list in files_lists:
-        print(f'processing new model run, first file name: {file_list[0]}')
-        wfv_value_at_locs = np.empty((len(file_list) * times_per_file, len(lons)))
-        wfv_time = np.empty(len(file_list) * times_per_file, dtype='datetime64[s]')
-        nn = 0
-        for idx, fname in enumerate(file_list):
-            if file_type == 'fvcom':
-                wfv_temp = xr.open_dataset(
-                    fname, decode_times=False, drop_variables=['siglay', 'siglev']
-                )
-                ddhh_vec = [
-                    to_datetime('1858-11-17') + Timedelta(int(time_val * 24), 'h')
-                    for time_val in wfv_temp.time.values
-                ]
-            elif file_type == 'wrf':
-                wfv_temp = xr.open_dataset(fname)
-                ddhh = datetime.fromisoformat(fname[-19::])
-
-            if idx == 0:
-                if file_type == 'fvcom':
-                    wfv_grid_tree = KDTree(np.c_[wfv_temp.lon.values, wfv_temp.lat.values])
-                elif file_type == 'wrf':
-                    wfv_grid_tree = KDTree(
-                        np.c_[
-                            wfv_temp['XLONG'].values.flatten(),
-                            wfv_temp['XLAT'].values.flatten(),
-                        ]
-                    )
-                wfv_d, wfv_grid_ind = wfv_grid_tree.query(np.c_[lons, lats])
+    run_function = partial(
+        _extract_run_at_locations,
+        file_type=file_type,
+        variable_name=variable_name,
+        lons=lons,
+        lats=lats,
+        grid_cache_directory=grid_cache_directory,
+        resume_directory=resume_directory,
+        direct_read=direct_read,
+        interpolation=interpolation,
+        dtype=dtype,
+    )
+
+    return _map_over_runs(run_function, files_lists, n_workers, run_ids)
+
+
+def _extract_run_at_locations(
+    file_list: List,
+    file_type: str,
+    variable_name: str,
+    lons,
+    lats,
+    grid_cache_directory: PathLike = None,
+    resume_directory: PathLike = None,
+    direct_read: bool = False,
+    interpolation: str = 'nearest',
+    dtype=float,
+    run_id: str = None,
+) -> List:
+    """
+    :param file_list: list of files for one model run
+    :param run_id: unique name of the model run for its manifest
+    :return: times and variables at the locations for the model run
+    """
 
-            if file_type == 'fvcom':
-                value_temp = (
-                    wfv_temp[variable_name]
-                    .isel(siglay=vertical_layer, node=wfv_grid_ind)
-                    .values
-                )
-                for ii, ddhh in enumerate(ddhh_vec):
-                    wfv_time[nn] = np.datetime64(ddhh)
-                    wfv_value_at_locs[nn, :] = value_temp[ii, :]
-                    nn += 1
-            elif file_type == 'wrf':
-                wfv_value_at_locs[idx, :] = wfv_temp[variable_name].values.flatten()[
-                    wfv_grid_ind
-                ]
-                wfv_time[idx] = np.datetime64(ddhh)
+    if file_type == 'fvcom':
+        times_per_file = 24
+        vertical_layer = 0
+    elif file_type == 'wrf':
+        times_per_file = 1
+
+    manifest = None
+    first_file = 0
+    if resume_directory is not None:
+        settings = {
+            'output': 'locations',
+            'file_type': file_type,
+            'variable_name': variable_name,
+            'locations': locations_signature(lons, lats),
+            'interpolation': interpolation,
+        }
+        manifest = RunManifest(resume_directory, file_list, settings, run_id=run_id)
+        first_file = manifest.number_processed
+
+    print(f'processing new model run, first file name: {file_list[0]}')
+    if first_file > 0:
+        print(f'resuming after {first_file} processed files')
+    number_new_files = len(file_list) - first_file
+    wfv_value_at_locs = np.empty((number_new_files * times_per_file, len(lons)), dtype=dtype)
+    wfv_time = np.empty(number_new_files * times_per_file, dtype='datetime64[s]')
+    nn = 0
+    for idx, fname in enumerate(file_list[first_file::], start=first_file):
+        nn_file = nn
+        if idx == first_file:
+            # all files of the run share the same grid, so the interpolation from the
+            # grid nodes to the locations is one sparse matrix for all the times
+            wfv_grid_ind, interpolation_operator = grid_interpolation_at_locations(
+                fname,
+                file_type,
+                lons,
+                lats,
+                method=interpolation,
+                cache_directory=grid_cache_directory,
+            )
+            if direct_read:
+                hyperslab = _hyperslab_at_grid_index(fname, file_type, variable_name, wfv_grid_ind)
+
+        if direct_read:
+            time_values, value_temp = _read_hyperslab(fname, variable_name, hyperslab)
+        elif file_type == 'fvcom':
+            wfv_temp = xr.open_dataset(
+                fname, decode_times=False, drop_variables=['siglay', 'siglev']
+            )
+            time_values = wfv_temp.time.values
+            value_temp = (
+                wfv_temp[variable_name].isel(siglay=vertical_layer, node=wfv_grid_ind).values
+            )
+        elif file_type == 'wrf':
+            wfv_temp = xr.open_dataset(fname)
+            value_temp = wfv_temp[variable_name].values.flatten()[wfv_grid_ind][None, :]
+        value_temp = interpolation_operator.dot(value_temp.T).T
+
+        if file_type == 'fvcom':
+            ddhh_vec = [
+                to_datetime('1858-11-17') + Timedelta(int(time_val * 24), 'h')
+                for time_val in time_values
+            ]
+            for ii, ddhh in enumerate(ddhh_vec):
+                wfv_time[nn] = np.datetime64(ddhh)
+                wfv_value_at_locs[nn, :] = value_temp[ii, :]
                 nn += 1
+        elif file_type == 'wrf':
+            ddhh = datetime.fromisoformat(fname[-19::])
+            wfv_value_at_locs[nn, :] = value_temp[0, :]
+            wfv_time[nn] = np.datetime64(ddhh)
+            nn += 1
+
+        if manifest is not None:
+            manifest.append(
+                fname,
+                rows={'time': wfv_time[nn_file:nn], 'values': wfv_value_at_locs[nn_file:nn]},
+                last_time=wfv_time[nn - 1],
+            )
 
-        # remove non-unique values
-        wfv_time, idx_start = np.unique(wfv_time[0:nn], return_index=True)
-        wfv_value_at_locs = wfv_value_at_locs[idx_start, :]
+    if manifest is not None:
+        # all the processed files of the run, including those from previous invocations
+        manifest.flush()
+        rows = manifest.load()
+        if rows is not None:
+            wfv_time, wfv_value_at_locs = rows['time'], rows['values'].astype(dtype, copy=False)
+            nn = len(wfv_time)
 
-        if variable_name == 'T2':
-            wfv_value_at_locs += K2C
+    # remove non-unique values
+    wfv_time, idx_start = np.unique(wfv_time[0:nn], return_index=True)
+    wfv_value_at_locs = wfv_value_at_locs[idx_start, :]
 
-        output_list.append([wfv_time, wfv_value_at_locs])
+    if variable_name == 'T2':
+        wfv_value_at_locs += K2C
 
-    return output_list
+    return [wfv_time, wfv_value_at_locs]
+
+
+def _hyperslab_at_grid_index(
+    fname: PathLike, file_type: str, variable_name: str, grid_index: np.ndarray
+) -> dict:
+    """
+    :param fname: a "wrf" cstm file or "fvcom" output file
+    :param file_type: "wrf" or "fvcom"
+    :param variable_name: variable name to extract
+    :param grid_index: index of the (flattened) grid nodes to read
+    :return: per-dimension indices of the variable to read and the location indices within the read block
+    """
+
+    import netCDF4
+
+    if file_type == 'fvcom':
+        horizontal_dims = 1  # node
+    elif file_type == 'wrf':
+        horizontal_dims = 2  # south_north, west_east
+
+    with netCDF4.Dataset(fname) as wfv_temp:
+        variable = wfv_temp[variable_name]
+        dimensions = variable.dimensions
+        shape = variable.shape
+
+    # all times of the file, the first (surface) layer of any other dimension
+    time_dims = [dim for dim in dimensions[0:-horizontal_dims] if dim.lower() == 'time']
+    indices = [slice(None) if dim in time_dims else 0 for dim in dimensions[0:-horizontal_dims]]
+
+    # bounding indices of the locations along each horizontal dimension, which must
+    # be sorted and unique for netCDF4
+    location_indices = []
+    for dim_index in np.unravel_index(grid_index, shape[-horizontal_dims::]):
+        unique_index, inverse = np.unique(dim_index, return_inverse=True)
+        indices.append(unique_index)
+        location_indices.append(inverse)
+
+    return {'indices': tuple(indices), 'locations': tuple(location_indices)}
+
+
+def _read_hyperslab(fname: PathLike, variable_name: str, hyperslab: dict) -> tuple:
+    """
+    :param fname: a "wrf" cstm file or "fvcom" output file
+    :param variable_name: variable name to extract
+    :param hyperslab: indices from _hyperslab_at_grid_index
+    :return: raw (undecoded) time values, if any, and the variable (time x location)
+    """
+
+    import netCDF4
+
+    with netCDF4.Dataset(fname) as wfv_temp:
+        time_values = np.asarray(wfv_temp['time'][:]) if 'time' in wfv_temp.variables else None
+        block = wfv_temp[variable_name][hyperslab['indices']]
+
+    block = np.ma.filled(np.ma.asarray(block, dtype=float), np.nan)
+    values = block[(Ellipsis,) + hyperslab['locations']]
+    return time_values, values.reshape(-1, values.shape[-1])
 
 
 def extract_daily_timeseries_global(
-    files_lists: List, file_type: str, variable_name: str,
+    files_lists: List,
+    file_type: str,
+    variable_name: str,
+    n_workers: int = 1,
+    lazy: bool = False,
+    chunks: dict = None,
+    memory_limit: str = None,
+    resume_directory: PathLike = None,
+    regions: tuple = None,
+    dtype=None,
+    run_ids: List = None,
 ) -> List:
+    """
+    :param files_lists: list of list of files for each model run
+    :param file_type: "wrf" cstm file or "fvcom" output file
+    :param variable_name: variable name to extract
+    :param n_workers: number of processes to extract the model runs concurrently (1 = serial), or number of dask workers if lazy
+    :param lazy: open each model run as one lazy, chunked dask-backed dataset and compute the daily means out-of-core
+    :param chunks: dask chunk sizes of the lazy datasets (default is one chunk per file)
+    :param memory_limit: memory limit per dask worker if lazy (e.g., "4GB"), uses dask.distributed when set
+    :param resume_directory: directory of the run manifests, so only new days are extracted on re-invocation, not saved if None (not lazy)
+    :param run_ids: unique name of each model run for its manifest, named by its first file if None
+    :param regions: region names and sparse averaging matrix from preprocessing.regions.grid_region_operator, to return the daily region means instead of the global fields (not lazy)
+    :param dtype: data type of the daily fields (the sums are always in double precision), that of the model variable if None
+    :return: list of days and daily mean global fields (or region means) for each model run
+    """
 
     if file_type == 'fvcom':
-        days_per_file = 1
-        vertical_layer = 0
         if variable_name == 'LST':
             variable_name = 'temp'
-    elif file_type == 'wrf':
-        days_per_file = 1 / 24
-    else:
+    elif file_type != 'wrf':
         raise ValueError(f'file_type {file_type} not recognized')
 
-    output_list = []
-    for file_list in files_lists:
-        print(f'processing new model run, first file name: {file_list[0]}')
-        wfv_time = np.empty(ceil(len(file_list) * days_per_file), dtype='datetime64[s]')
-        nn = 0
-        for idx, fname in enumerate(file_list):
-            if file_type == 'fvcom':
-                wfv_temp = xr.open_dataset(
-                    fname, decode_times=False, drop_variables=['siglay', 'siglev']
-                )
-                wfv_time[nn] = to_datetime('1858-11-17') + Timedelta(
-                    int(wfv_temp.time.values[0] * 24), 'h'
-                )
-            elif file_type == 'wrf':
-                wfv_temp = xr.open_dataset(fname)
-                ddhh = datetime.fromisoformat(fname[-19::])
-                if ddhh.hour == 0:
-                    wfv_time[nn] = np.datetime64(ddhh)
+    if lazy:
+        if resume_directory is not None or regions is not None:
+            raise ValueError('resume_directory and regions are not supported when lazy')
+        return _compute_daily_global_lazy(
+            files_lists, file_type, variable_name, n_workers, chunks, memory_limit, dtype
+        )
+
+    run_function = partial(
+        _extract_run_daily_global,
+        file_type=file_type,
+        variable_name=variable_name,
+        resume_directory=resume_directory,
+        regions=regions,
+        dtype=dtype,
+    )
+
+    return _map_over_runs(run_function, files_lists, n_workers, run_ids)
+
+
+def _extract_run_daily_global(
+    file_list: List,
+    file_type: str,
+    variable_name: str,
+    resume_directory: PathLike = None,
+    regions: tuple = None,
+    dtype=None,
+    run_id: str = None,
+) -> List:
+    """
+    :param file_list: list of files for one model run
+    :param run_id: unique name of the model run for its manifest
+    :return: days and daily mean global fields for the model run
+    """
 
+    if file_type == 'fvcom':
+        days_per_file = 1
+        vertical_layer = 0
+        time_dim = 'time'
+    elif file_type == 'wrf':
+        days_per_file = 1 / 24
+        time_dim = 'Time'
+
+    manifest = None
+    first_file = 0
+    if resume_directory is not None:
+        settings = {'output': 'daily', 'file_type': file_type, 'variable_name': variable_name}
+        if regions is not None:
+            settings['regions'] = regions_signature(regions)
+        manifest = RunManifest(resume_directory, file_list, settings, run_id=run_id)
+        first_file = manifest.number_processed
+
+    print(f'processing new model run, first file name: {file_list[0]}')
+    if first_file > 0:
+        print(f'resuming after {first_file} processed files')
+    accumulator = DailyMeanAccumulator(
+        ceil((len(file_list) - first_file) * days_per_file),
+        operator=None if regions is None else regions[1],
+        dtype=float if dtype is None else dtype,
+    )
+    for idx, fname in enumerate(file_list[first_file::], start=first_file):
+        number_finished = accumulator.number_finished
+        if file_type == 'fvcom':
+            wfv_temp = xr.open_dataset(
+                fname, decode_times=False, drop_variables=['siglay', 'siglev']
+            )
+            wfv_field = wfv_temp[variable_name].isel(siglay=vertical_layer)
+            # each file is one day
+            accumulator.start_day(
+                to_datetime('1858-11-17') + Timedelta(int(wfv_temp.time.values[0] * 24), 'h')
+            )
+            for tdx in range(wfv_field.sizes[time_dim]):
+                accumulator.add(wfv_field.isel({time_dim: tdx}).values)
+            accumulator.finish_day()
+        elif file_type == 'wrf':
+            wfv_temp = xr.open_dataset(fname)
+            wfv_field = wfv_temp[variable_name]
+            ddhh = datetime.fromisoformat(fname[-19::])
+            # each file is one hour
+            if ddhh.hour == 0:
+                accumulator.start_day(ddhh)
+            if accumulator.day_started:
+                accumulator.add(wfv_field.isel({time_dim: 0}).values)
+            if ddhh.hour == 23 and accumulator.day_started:
+                accumulator.finish_day()
+
+        if manifest is not None:
+            if accumulator.number_finished > number_finished:
+                manifest.append(
+                    fname,
+                    rows={
+                        'time': accumulator.day_times[-1::],
+                        'values': accumulator.daily_values[-1::],
+                    },
+                    last_time=accumulator.day_times[-1],
+                )
+            else:
+                # hours of an unfinished day are only recorded once the day is finished
+                manifest.append(fname, end_of_group=not accumulator.day_started)
+
+    rows = None
+    if manifest is not None:
+        # all the processed days of the run, including those from previous invocations
+        manifest.flush()
+        rows = manifest.load()
+        if first_file == len(file_list):
+            # no file was opened, get the field metadata from the last file
             if file_type == 'fvcom':
-                value_temp = (
-                    wfv_temp[variable_name].isel(siglay=vertical_layer).mean(dim='time')
+                wfv_temp = xr.open_dataset(
+                    file_list[-1], decode_times=False, drop_variables=['siglay', 'siglev']
                 )
-                if idx == 0:
-                    wfv_daily_values = value_temp
-                else:
-                    wfv_daily_values = xr.concat([wfv_daily_values, value_temp], 'time')
-                nn += 1
+                wfv_field = wfv_temp[variable_name].isel(siglay=vertical_layer)
             elif file_type == 'wrf':
-                if ddhh.hour == 0:
-                    value_temp = wfv_temp[variable_name]
-                else:
-                    value_temp = xr.concat([value_temp, wfv_temp[variable_name]], dim='Time')
-                if ddhh.hour == 23:
-                    value_temp = value_temp.mean(dim='Time')
-                    if nn == 0:
-                        wfv_daily_values = value_temp
-                    else:
-                        wfv_daily_values = xr.concat([wfv_daily_values, value_temp], 'time')
-                    nn += 1
-
-        # remove non-unique values
-        wfv_time, idx_start = np.unique(wfv_time[0:nn], return_index=True)
-        wfv_daily_values = wfv_daily_values.isel(time=idx_start)
-
-        # get the coordinates back
-        if file_type == 'wrf':
-            wfv_daily_values = wfv_daily_values.assign_coords(
-                {
-                    'XLONG': wfv_temp['XLONG'].isel(Time=0),
-                    'XLAT': wfv_temp['XLAT'].isel(Time=0),
-                }
-            )
+                wfv_temp = xr.open_dataset(file_list[-1])
+                wfv_field = wfv_temp[variable_name]
 
+    if rows is not None:
+        wfv_time, wfv_values = rows['time'], rows['values']
+    else:
+        # no day of the run is finished yet when resuming
+        wfv_time = accumulator.day_times
+        wfv_values = accumulator.daily_values
+    if wfv_values is None:
+        # no field was added to the accumulator
+        if regions is not None:
+            shape = (len(regions[0]),)
+        else:
+            shape = wfv_field.isel({time_dim: 0}).shape
+        wfv_values = np.empty((0,) + shape)
+
+    if dtype is None:
+        dtype = wfv_field.dtype
+
+    # remove non-unique values
+    wfv_time, idx_start = np.unique(wfv_time, return_index=True)
+
+    if regions is not None:
+        wfv_daily_values = xr.DataArray(
+            data=wfv_values[idx_start].astype(dtype, copy=False),
+            coords={'region': regions[0]},
+            dims=('time', 'region'),
+            name=wfv_field.name,
+        )
         if variable_name == 'T2':
             wfv_daily_values += K2C
+        return [wfv_time, wfv_daily_values]
+
+    wfv_daily_values = xr.DataArray(
+        data=wfv_values[idx_start].astype(dtype, copy=False),
+        coords={
+            name: coord for name, coord in wfv_field.coords.items() if time_dim not in coord.dims
+        },
+        dims=('time',) + tuple(dim for dim in wfv_field.dims if dim != time_dim),
+        name=wfv_field.name,
+    )
+
+    # get the coordinates back
+    if file_type == 'wrf':
+        wfv_daily_values = wfv_daily_values.assign_coords(
+            {'XLONG': wfv_temp['XLONG'].isel(Time=0), 'XLAT': wfv_temp['XLAT'].isel(Time=0)}
+        )
+
+    if variable_name == 'T2':
+        wfv_daily_values += K2C
+
+    return [wfv_time, wfv_daily_values]
+
+
+def ensemble_matrix(
+    run_list: List,
+    time_start=None,
+    time_end=None,
+    mask: np.ndarray = None,
+    filename: PathLike = None,
+    dtype=float,
+) -> tuple:
+    """
+    :param run_list: list of [time, values] for each model run, e.g., from extract_daily_timeseries_global
+    :param time_start: first time of the window (inclusive), from the start if None
+    :param time_end: last time of the window (exclusive), to the end if None
+    :param mask: boolean mask of the (flattened) space nodes to keep, e.g., a lake mask, all nodes if None
+    :param filename: .npy file to memory-map the matrix into, kept in memory if None
+    :param dtype: data type of the matrix
+    :return: matrix (runs x features) with the features ordered by time then node,
+        and the time and (flattened) node index of each feature
+    """
+
+    def time_index(run_time):
+        window = np.ones(run_time.shape, dtype=bool)
+        if time_start is not None:
+            window &= run_time >= np.datetime64(time_start)
+        if time_end is not None:
+            window &= run_time < np.datetime64(time_end)
+        return np.flatnonzero(window)
+
+    first_time = np.asarray(run_list[0][0])
+    first_index = time_index(first_time)
+    number_nodes = int(np.prod(np.shape(run_list[0][1])[1::]))
+    if mask is None:
+        node_index = np.arange(number_nodes)
+    else:
+        node_index = np.flatnonzero(np.asarray(mask).ravel())
+
+    shape = (len(run_list), len(first_index) * len(node_index))
+    if filename is None:
+        matrix = np.empty(shape, dtype=dtype)
+    else:
+        matrix = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=shape)
+
+    for rdx, run in enumerate(run_list):
+        run_time = np.asarray(run[0])
+        tdx = time_index(run_time)
+        if len(tdx) != len(first_index):
+            raise ValueError(
+                f'model run {rdx} has {len(tdx)} times in the window, '
+                f'but the first run has {len(first_index)}'
+            )
+        # the features are labelled with the times of the first run
+        if not np.array_equal(run_time[tdx], first_time[first_index]):
+            raise ValueError(f'model run {rdx} has other times in the window than the first run')
+        values = np.asarray(run[1][tdx]).reshape(len(tdx), number_nodes)
+        matrix[rdx] = values[:, node_index].ravel()
+
+    feature_time = np.repeat(first_time[first_index], len(node_index))
+    feature_node = np.tile(node_index, len(first_index))
+
+    return matrix, feature_time, feature_node
+
+
+def _compute_daily_global_lazy(
+    files_lists: List,
+    file_type: str,
+    variable_name: str,
+    n_workers: int = 1,
+    chunks: dict = None,
+    memory_limit: str = None,
+    dtype=None,
+) -> List:
+    """
+    :param files_lists: list of list of files for each model run
+    :return: list of days and daily mean global fields for each model run, computed with dask
+    """
+
+    import dask
+
+    lazy_list = [
+        _open_run_daily_global_lazy(file_list, file_type, variable_name, chunks)
+        for file_list in files_lists
+    ]
+    if dtype is not None:
+        lazy_list = [[run[0], run[1].astype(dtype)] for run in lazy_list]
+
+    # compute all the model runs in one dask graph
+    if memory_limit is not None:
+        from dask.distributed import Client, LocalCluster
+
+        with LocalCluster(
+            n_workers=n_workers, threads_per_worker=1, memory_limit=memory_limit
+        ) as cluster, Client(cluster):
+            daily_values_list = dask.compute(*[run[1] for run in lazy_list])
+    else:
+        with dask.config.set(scheduler='threads', num_workers=n_workers):
+            daily_values_list = dask.compute(*[run[1] for run in lazy_list])
+
+    return [[run[0], daily_values] for run, daily_values in zip(lazy_list, daily_values_list)]
+
+
+def _open_run_daily_global_lazy(
+    file_list: List, file_type: str, variable_name: str, chunks: dict = None,
+) -> List:
+    """
+    :param file_list: list of files for one model run
+    :return: days and the lazy (not yet computed) daily mean global fields for the model run
+    """
+
+    print(f'opening new model run, first file name: {file_list[0]}')
+    if file_type == 'fvcom':
+        wfv_run = xr.open_mfdataset(
+            file_list,
+            preprocess=partial(_preprocess_fvcom_file, variable_name=variable_name),
+            combine='nested',
+            concat_dim='time',
+            data_vars='minimal',
+            coords='minimal',
+            compat='override',
+            chunks=chunks,
+            decode_times=False,
+            drop_variables=['siglay', 'siglev'],
+        )
+    elif file_type == 'wrf':
+        wfv_run = xr.open_mfdataset(
+            file_list,
+            preprocess=partial(_preprocess_wrf_file, variable_name=variable_name),
+            combine='nested',
+            concat_dim='time',
+            data_vars='minimal',
+            coords='minimal',
+            compat='override',
+            chunks=chunks,
+        )
+        # only keep complete days (from the 00 hour to the 23 hour)
+        days = wfv_run['day'].values
+        hours = wfv_run['time'].dt.hour.values
+        complete_days = np.intersect1d(days[hours == 0], days[hours == 23])
+        wfv_run = wfv_run.isel(time=np.isin(days, complete_days))
+
+    # remove non-unique values
+    _, idx_time = np.unique(wfv_run['time'].values, return_index=True)
+    wfv_run = wfv_run.isel(time=idx_time)
+
+    wfv_daily_values = wfv_run[variable_name].groupby('day').mean(dim='time')
+    wfv_time = wfv_daily_values['day'].values.astype('datetime64[s]')
+    wfv_daily_values = wfv_daily_values.rename(day='time').drop_vars('time')
+
+    if variable_name == 'T2':
+        wfv_daily_values += K2C
+
+    return [wfv_time, wfv_daily_values]
+
+
+def _preprocess_fvcom_file(wfv_temp: xr.Dataset, variable_name: str) -> xr.Dataset:
+    """
+    open_mfdataset preprocess hook: decodes the FVCOM time and labels all the times of the file with its day
+
+    :param wfv_temp: Dataset of one FVCOM output file (opened with decode_times=False)
+    :param variable_name: variable name to extract
+    :return: Dataset of the surface layer of the variable with "time" and "day" coordinates
+    """
+
+    time = np.array(
+        [
+            to_datetime('1858-11-17') + Timedelta(int(time_val * 24), 'h')
+            for time_val in wfv_temp.time.values
+        ],
+        dtype='datetime64[ns]',
+    )
+    wfv_field = wfv_temp[variable_name].isel(siglay=0)
+    wfv_field = wfv_field.assign_coords(time=time, day=('time', np.full(time.shape, time[0])))
+
+    return wfv_field.to_dataset()
+
+
+def _preprocess_wrf_file(wfv_temp: xr.Dataset, variable_name: str) -> xr.Dataset:
+    """
+    open_mfdataset preprocess hook: gets the WRF time from the file name and its day
+
+    :param wfv_temp: Dataset of one WRF cstm file
+    :param variable_name: variable name to extract
+    :return: Dataset of the variable with "time" and "day" coordinates and time-invariant XLONG, XLAT
+    """
+
+    ddhh = datetime.fromisoformat(wfv_temp.encoding['source'][-19::])
+    time = np.array([ddhh], dtype='datetime64[ns]')
+    wfv_field = wfv_temp[variable_name].reset_coords(drop=True).rename(Time='time')
+    wfv_field = wfv_field.assign_coords(
+        time=time,
+        day=('time', time.astype('datetime64[D]').astype('datetime64[ns]')),
+        XLONG=wfv_temp['XLONG'].isel(Time=0, drop=True),
+        XLAT=wfv_temp['XLAT'].isel(Time=0, drop=True),
+    )
+
+    return wfv_field.to_dataset()
 
-        output_list.append([wfv_time, wfv_daily_values])
+
+class DailyMeanAccumulator:
+    """
+    Streaming daily mean of fields: keeps the running (NaN-skipping) sum of the
+    fields of the current day only, and writes each finished day into a
+    preallocated (day, space) array, or (day, region) array when an averaging
+    operator is given
+    """
+
+    def __init__(self, number_of_days: int, operator=None, dtype=float):
+        """
+        :param number_of_days: maximum number of days to be accumulated
+        :param operator: sparse matrix (region x flattened field) applied to each daily mean field
+        :param dtype: data type of the stored daily values, the sums of the current day are double precision
+        """
+        self.number_of_days = number_of_days
+        self.operator = operator
+        self.dtype = dtype
+        self.number_finished = 0
+        self.day_started = False
+        self._day_times = np.empty(number_of_days, dtype='datetime64[s]')
+        self._daily_values = None
+        self._sum = None
+        self._count = None
+
+    @property
+    def day_times(self) -> np.ndarray:
+        return self._day_times[0 : self.number_finished]
+
+    @property
+    def daily_values(self) -> np.ndarray:
+        """daily values of the finished days, None if no field was added"""
+        if self._daily_values is None:
+            return None
+        return self._daily_values[0 : self.number_finished]
+
+    def start_day(self, day_time):
+        """
+        :param day_time: time stamp of the day, any partially accumulated day is discarded
+        """
+        self._day_times[self.number_finished] = np.datetime64(day_time)
+        if self._sum is not None:
+            self._sum[:] = 0.0
+            self._count[:] = 0
+        self.day_started = True
+
+    def add(self, field: np.ndarray):
+        """
+        :param field: one time slice of the field to add to the current day
+        """
+        if self._sum is None:
+            if self.operator is None:
+                shape = (self.number_of_days,) + field.shape
+            else:
+                shape = (self.number_of_days, self.operator.shape[0])
+            self._daily_values = np.empty(shape, dtype=self.dtype)
+            self._sum = np.zeros(field.shape)
+            self._count = np.zeros(field.shape, dtype=int)
+        valid = ~np.isnan(field)
+        self._sum += np.where(valid, field, 0.0)
+        self._count += valid
+
+    def finish_day(self):
+        """
+        computes the mean of the current day and stores it
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if self.operator is None:
+                np.divide(self._sum, self._count, out=self._daily_values[self.number_finished])
+            else:
+                daily_mean = (self._sum / self._count).ravel()
+                self._daily_values[self.number_finished] = self.operator.dot(daily_mean)
+                # regions without grid nodes
+                self._daily_values[self.number_finished, self.operator.getnnz(axis=1) == 0] = np.nan
+        self.number_finished += 1
+        self.day_started = False
+
+
+def _map_over_runs(
+    run_function: Callable, files_lists: List, n_workers: int = 1, run_ids: List = None
+) -> List:
+    """
+    :param run_function: function that processes the list of files of one model run
+    :param files_lists: list of list of files for each model run
+    :param n_workers: number of processes to use, model runs are processed serially if 1
+    :param run_ids: unique name of each model run, passed to run_function as run_id
+    :return: list of outputs of run_function, in the same order as files_lists
+    """
+
+    if run_ids is None:
+        run_ids = [None] * len(files_lists)
+    elif len(run_ids) != len(files_lists):
+        raise ValueError(f'{len(run_ids)} run_ids for {len(files_lists)} model runs')
+
+    if n_workers is None or n_workers <= 1 or len(files_lists) <= 1:
+        return [
+            run_function(file_list, run_id=run_id)
+            for file_list, run_id in zip(files_lists, run_ids)
+        ]
+
+    with ProcessPoolExecutor(max_workers=min(n_workers, len(files_lists))) as executor:
+        futures = [
+            executor.submit(run_function, file_list, run_id=run_id)
+            for file_list, run_id in zip(files_lists, run_ids)
+        ]
+        # outputs in the order of the inputs
+        output_list = [future.result() for future in futures]
 
     return output_list
 
@@ -181,51 +760,129 @@ def align_model_with_observations(model: dict, data: List, remove_noise: bool =
     # make the vectors from the model ensemble didct and buoy data list
     variables = list(model.keys())
     variables.remove('runs')
+    nruns = len(model['runs'])
 
-    time_vector = np.empty((0), dtype='datetime64')
-    data_vector = {}
-    model_vector = {}
     earliest_end_time = model[variables[0]][0][0][-1]
     for variable in variables:
-        data_vector[variable] = np.empty((0), dtype='float')
-        model_vector[variable] = np.empty((len(model['runs']), 0), dtype='float')
         # check earliest model end time
         for this_run in model[variable]:
             earliest_end_time = min(earliest_end_time, this_run[0][-1])
     print(f'earliest model end time: {earliest_end_time}')
 
+    # observation times of each location and their position in the output vectors
+    masks = [np.asarray(this_loc['data']['time'] <= earliest_end_time) for this_loc in data]
+    obs_times = [np.asarray(this_loc['data']['time'])[mask] for this_loc, mask in zip(data, masks)]
+    offsets = np.cumsum([0] + [len(obs_time) for obs_time in obs_times])
+
+    time_vector = np.empty(offsets[-1], dtype='datetime64[ns]')
+    data_vector = {variable: np.empty(offsets[-1], dtype='float') for variable in variables}
+    model_vector = {
+        variable: np.empty((nruns, offsets[-1]), dtype='float') for variable in variables
+    }
+
+    # one sorted time index per run
+    time_indices = {
+        variable: [_sorted_time_index(this_run[0]) for this_run in model[variable]]
+        for variable in variables
+    }
+
     for bdx, this_loc in enumerate(data):
-        mask = this_loc['data']['time'] <= earliest_end_time
-        obs_time = this_loc['data']['time'][mask]
-        time_vector = np.append(time_vector, obs_time)
+        obs_slice = slice(offsets[bdx], offsets[bdx + 1])
+        time_vector[obs_slice] = obs_times[bdx]
         for variable in variables:
-            # print(variable)
-            data_vector[variable] = np.append(
-                data_vector[variable], this_loc['data'][variable][mask]
-            )
+            data_vector[variable][obs_slice] = np.asarray(this_loc['data'][variable])[masks[bdx]]
 
-            model_temp = np.empty((len(model['runs']), len(obs_time)))
             for rr, this_run in enumerate(model[variable]):
-                # print(rr)
-                _, _, mod_int_ind = np.intersect1d(obs_time, this_run[0], return_indices=True)
-                if remove_noise:
-                    model_temp[rr, :] = remove_2dx_waves(this_run[1][mod_int_ind, bdx])
-                else:
-                    model_temp[rr, :] = this_run[1][mod_int_ind, bdx]
-            model_vector[variable] = np.append(model_vector[variable], model_temp, axis=1)
+                mod_int_ind = _model_time_indices(time_indices[variable][rr], obs_times[bdx])
+                model_vector[variable][rr, obs_slice] = this_run[1][mod_int_ind, bdx]
+            if remove_noise:
+                # filter all the runs at once
+                remove_2dx_waves_batched(
+                    model_vector[variable][:, obs_slice], axis=1, inplace=True
+                )
 
     return {'time': time_vector, 'data': data_vector, 'model': model_vector}
 
 
+def _sorted_time_index(model_time: np.ndarray) -> tuple:
+    """
+    :param model_time: times of a model run
+    :return: the sorted model times and the indices that sort them
+    """
+
+    model_time = np.asarray(model_time)
+    sorter = np.argsort(model_time, kind='stable')
+    return model_time[sorter], sorter
+
+
+def _model_time_indices(time_index: tuple, obs_time: np.ndarray) -> np.ndarray:
+    """
+    :param time_index: sorted model times and the indices that sort them (from _sorted_time_index)
+    :param obs_time: observation times to find in the model times
+    :return: indices of the model times equal to each of the observation times
+    """
+
+    sorted_time, sorter = time_index
+    obs_time = obs_time.astype(sorted_time.dtype)
+    position = np.searchsorted(sorted_time, obs_time)
+    position[position == len(sorted_time)] = 0
+    missing = sorted_time[position] != obs_time
+    if np.any(missing):
+        raise ValueError(f'observation time {obs_time[missing][0]} not found in model times')
+
+    return sorter[position]
+
+
 def remove_2dx_waves(ts):
     # removing noisy 2*delta(X) waves
-    bad_tol = 0.5 * np.sqrt(2) * np.std(ts)
-    for tdx, tss in enumerate(ts):
-        if tdx == 0 or tdx == ts.shape[0] - 1:
-            continue
-        tn = ts[tdx + 1]
-        tp = ts[tdx - 1]
-        if abs(tp - tss) > bad_tol and abs(tn - tss) > bad_tol:
-            ts[tdx] = 0.5 * (tp + tn)
+    return remove_2dx_waves_batched(ts, axis=0, inplace=True)
 
-    return ts
+
+def remove_2dx_waves_batched(values: np.ndarray, axis: int = 1, inplace: bool = False):
+    """
+    :param values: array of series, e.g., (ensemble, time, location)
+    :param axis: the time axis of values
+    :param inplace: filter values in place instead of a copy
+    :return: values with the noisy 2*delta(X) waves removed from every series
+
+    Same rule as the original per-element loop: a point is replaced by the mean of its
+    neighbours when it differs from both by more than 0.5*sqrt(2)*std of its series.
+    Points are visited in time order (so a replaced point is used as the previous
+    neighbour of the next), but only at the times where any series can change, and
+    each visit is vectorized over all the series.
+    """
+
+    if not inplace:
+        values = np.array(values, copy=True)
+
+    # view of the values with time as the first axis
+    series = np.moveaxis(values, axis, 0)
+    ntime = series.shape[0]
+    if ntime < 3:
+        return values
+
+    bad_tol = 0.5 * np.sqrt(2) * np.std(series, axis=0)
+
+    # candidate times flagged using the unfiltered neighbours
+    interior = series[1:-1]
+    flagged = (abs(series[:-2] - interior) > bad_tol) & (abs(series[2:] - interior) > bad_tol)
+    candidates = np.flatnonzero(flagged.reshape(ntime - 2, -1).any(axis=1)) + 1
+
+    # stack of times to visit in ascending order, a filtered time makes the next one a candidate
+    to_visit = list(candidates[::-1])
+    last_visited = 0
+    while to_visit:
+        tdx = to_visit.pop()
+        if tdx <= last_visited:
+            continue
+        last_visited = tdx
+        tp = series[tdx - 1]
+        tss = series[tdx]
+        tn = series[tdx + 1]
+        bad = (abs(tp - tss) > bad_tol) & (abs(tn - tss) > bad_tol)
+        if np.any(bad):
+            series[tdx] = np.where(bad, 0.5 * (tp + tn), tss)
+            if tdx + 1 < ntime - 1 and (not to_visit or to_visit[-1] != tdx + 1):
+                to_visit.append(tdx + 1)
+
+    return values
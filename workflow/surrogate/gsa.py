@@ -8,14 +8,30 @@ from numpy import (
     argsort,
     nanmean,
     array,
+    asarray,
+    diagonal,
+    einsum,
     empty,
     arange,
+    array_split,
+    concatenate,
+    matmul,
     nan_to_num,
+    percentile,
+    stack,
+    triu,
 )
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from wrf_fvcom.variables import PerturbedVariable, VariableDistribution
 from surrogate.utils import surrogate_model_predict
 
+# maximum number of sample values (samples x output points) in a block of the Sobol index computation
+SENSITIVITY_BLOCK_SIZE = 2**24
+
+# confidence level of the bootstrap intervals of the Sobol indices
+BOOTSTRAP_CONFIDENCE = 0.95
+
 ###########################################
 #  ____     ___    ____     ___    _      #
 # / ___|   / _ \  | __ )   / _ \  | |     #
@@ -49,17 +65,57 @@ class sobol(smethod):
         self.sens_names = ['main', 'total', 'jointt']
         smethod.__init__(self, variable_matrix, self.sens_names)
 
-    def sample(self, ninit, parameter_types=None):
+    def sample(self, ninit, parameter_types=None, dtype=float):
         print('Sampling SOBOL')
 
-        sam1 = random.rand(ninit, self.dim)
-        sam2 = random.rand(ninit, self.dim)
+        xsam = self._saltelli_sample(*self._base_samples(ninit, dtype=dtype))
+
+        self.nsam = xsam.shape[0]
+        self.sens_ready['main'] = True
+        self.sens_ready['total'] = True
+        self.sens_ready['jointt'] = True
+
+        return xsam
+
+    def sample_chunks(self, ninit, chunk_size, dtype=float):
+        """
+        :param ninit: number of base samples
+        :param chunk_size: number of base samples in each chunk
+        :param dtype: data type of the samples
+        :return: generator of the samples of each chunk, in the layout of sample
+        """
+        print('Sampling SOBOL in chunks')
+
+        self.nsam = (self.dim + 2) * ninit
+        self._sums = None
+        self.sens_ready['main'] = True
+        self.sens_ready['total'] = True
+        self.sens_ready['jointt'] = True
+        for first in range(0, ninit, chunk_size):
+            yield self._saltelli_sample(*self._base_samples(min(chunk_size, ninit - first), dtype))
+
+    def _base_samples(self, ninit, dtype=float):
+        """
+        :param ninit: number of base samples
+        :param dtype: data type of the samples
+        :return: the two independent base samples (ninit x dim)
+        """
+        sam1 = random.rand(ninit, self.dim).astype(dtype, copy=False)
+        sam2 = random.rand(ninit, self.dim).astype(dtype, copy=False)
 
         for pp, par_type in enumerate(self.ptypes):
             if par_type == 'int':
                 sam1[:, pp] = round(sam1[:, pp])
                 sam2[:, pp] = round(sam2[:, pp])
 
+        return sam1, sam2
+
+    def _saltelli_sample(self, sam1, sam2):
+        """
+        :param sam1: first base sample (ninit x dim)
+        :param sam2: second base sample (ninit x dim)
+        :return: sam1, sam2 and sam1 with each column from sam2 ((dim + 2) * ninit x dim)
+        """
         xsam = vstack((sam1, sam2))
 
         for id in range(self.dim):
@@ -67,88 +123,313 @@ class sobol(smethod):
             samid[:, id] = sam2[:, id]
             xsam = vstack((xsam, samid))
 
-        self.nsam = xsam.shape[0]
-        self.sens_ready['main'] = True
-        self.sens_ready['total'] = True
-        self.sens_ready['jointt'] = True
-
         return xsam
 
-    def compute(self, ysam, computepar=None):
-        ninit = self.nsam // (self.dim + 2)
+    def accumulate(self, ysam):
+        """
+        adds the model values of a chunk from sample_chunks to the running sums of the estimators
+
+        :param ysam: model values at the samples of the chunk, for one output (samples) or many (samples x points)
+        """
+        ysam = asarray(ysam, dtype=float).reshape(ysam.shape[0], -1)
+        ninit = ysam.shape[0] // (self.dim + 2)
+        if self._sums is None:
+            # sums of the values shifted by the mean of the first chunk, to keep their precision
+            self._sums = {
+                'shift': ysam[: 2 * ninit].mean(axis=0),
+                'count': 0,
+                'all': 0,
+                'base': 0,
+                'base2': 0,
+                'difference': 0,
+                'main': 0,
+                'total': 0,
+                'joint': 0,
+            }
+        sums = self._sums
+
+        ysam = ysam - sums['shift']
         y1 = ysam[ninit : 2 * ninit]
-        yvar = var(ysam[: 2 * ninit])
-        si = zeros((self.dim,))
-        ti = zeros((self.dim,))
-        jtij = zeros((self.dim, self.dim))
+        y2 = ysam[2 * ninit :].reshape(self.dim, ninit, -1) - ysam[:ninit]
+
+        sums['count'] += ninit
+        sums['all'] = sums['all'] + ysam.sum(axis=0)
+        sums['base'] = sums['base'] + ysam[: 2 * ninit].sum(axis=0)
+        sums['base2'] = sums['base2'] + (ysam[: 2 * ninit] ** 2).sum(axis=0)
+        sums['difference'] = sums['difference'] + y2.sum(axis=1)
+        sums['main'] = sums['main'] + einsum('sp,isp->ip', y1, y2)
+        sums['total'] = sums['total'] + einsum('isp,isp->ip', y2, y2)
+        y2 = y2.transpose(2, 0, 1)
+        sums['joint'] = sums['joint'] + matmul(y2, y2.transpose(0, 2, 1))
+
+    def compute_accumulated(self):
+        """
+        :return: dictionary of the main, total and joint indices from the running sums of accumulate,
+            the same as compute on all the chunks together (output points in the last dimension)
+        """
+        sums = self._sums
+        ninit = sums['count']
+        yvar = sums['base2'] / (2 * ninit) - (sums['base'] / (2 * ninit)) ** 2
+        # compute centers the values by their mean over all the samples
+        ymean = sums['all'] / ((self.dim + 2) * ninit)
+
+        self.sens['main'] = (sums['main'] - ymean * sums['difference']) / ninit / yvar
+        self.sens['total'] = 0.5 * sums['total'] / ninit / yvar
+        jointt = triu(sums['joint'] / ninit / yvar[:, None, None], k=1)
+        self.sens['jointt'] = jointt.transpose(1, 2, 0)
 
-        for id in range(self.dim):
-            y2 = ysam[2 * ninit + id * ninit : 2 * ninit + (id + 1) * ninit] - ysam[:ninit]
-            si[id] = mean(y1 * y2) / yvar
-            ti[id] = 0.5 * mean(y2 * y2) / yvar
-            for jd in range(id):
-                y3 = (
-                    ysam[2 * ninit + id * ninit : 2 * ninit + (id + 1) * ninit]
-                    - ysam[2 * ninit + jd * ninit : 2 * ninit + (jd + 1) * ninit]
-                )
-                jtij[id, jd] = ti[id] + ti[jd] - 0.5 * mean(y3 * y3) / yvar
+        return self.sens
 
+    def compute(self, ysam, computepar=None):
+        """
+        :param ysam: model values at the samples, for one output (samples) or many (samples x points)
+        :param computepar: not used
+        :return: dictionary of the main, total and joint (in the total sense, upper triangle)
+            indices, with the output points in the last dimension for many outputs
+        """
+        ninit = self.nsam // (self.dim + 2)
+        single_output = ysam.ndim == 1
+        ysam = asarray(ysam, dtype=float).reshape(self.nsam, -1)
+
+        y1 = ysam[ninit : 2 * ninit]
+        yvar = var(ysam[: 2 * ninit], axis=0)
+        # differences of the samples with one column from sam2 to the sam1 samples (dim x ninit x points)
+        y2 = ysam[2 * ninit :].reshape(self.dim, ninit, -1) - ysam[:ninit]
+
+        si = einsum('sp,isp->ip', y1, y2) / ninit / yvar
+        ti = 0.5 * einsum('isp,isp->ip', y2, y2) / ninit / yvar
+        # ti + tj - 0.5 * mean((y2i - y2j)^2) / yvar reduces to mean(y2i * y2j) / yvar
+        y2 = y2.transpose(2, 0, 1)
+        jtij = matmul(y2, y2.transpose(0, 2, 1)) / ninit / yvar[:, None, None]
+        jtij = triu(jtij, k=1).transpose(1, 2, 0)
+
+        if single_output:
+            si, ti, jtij = si[:, 0], ti[:, 0], jtij[:, :, 0]
         self.sens['main'] = si
         self.sens['total'] = ti
-        self.sens['jointt'] = jtij.T
+        self.sens['jointt'] = jtij
 
         return self.sens
 
 
-def compute_sensitivities(surrogate_model, variable_matrix, sample_size=10000, kl_dict=None):
-
-    # get the sensitivity sample matrix
-    SensMethod = sobol(variable_matrix)
-    xsam = SensMethod.sample(sample_size)
-    # evaluate the surrogate model at the samples
-    ysam = surrogate_model_predict(surrogate_model, xsam, kl_dict=kl_dict)
-
-    npts = ysam.shape[1]
+def scheme_aggregation(variable_matrix):
+    """
+    :param variable_matrix: transformed perturbation matrix (run x scheme)
+    :return: names of the variables (consecutive schemes of the same variable), and the aggregation
+        matrix (variable x scheme) that sums the indices of the schemes of each variable
+    """
     variable_names = []
     variable_prior = ''
-    for sdx, scheme in enumerate(variable_matrix['scheme']):
+    scheme_variable = []
+    for scheme in variable_matrix['scheme']:
         variable_name = PerturbedVariable.class_from_scheme_name(scheme).name
         if variable_name != variable_prior:
             variable_names.append(variable_name)
         variable_prior = variable_name
-    ndim = len(variable_names)
+        scheme_variable.append(len(variable_names) - 1)
+
+    aggregation = zeros((len(variable_names), len(scheme_variable)))
+    aggregation[scheme_variable, arange(len(scheme_variable))] = 1
+    return variable_names, aggregation
+
+
+def compute_sensitivities(
+    surrogate_model,
+    variable_matrix,
+    sample_size=10000,
+    kl_dict=None,
+    dtype=float,
+    chunk_size=None,
+    number_bootstrap=0,
+    confidence=BOOTSTRAP_CONFIDENCE,
+    n_workers=1,
+    seed=None,
+):
+    """
+    :param surrogate_model: surrogate model, or list of models, see surrogate_model_predict
+    :param variable_matrix: transformed perturbation matrix (run x scheme) the surrogate was trained on
+    :param sample_size: number of base samples of the Saltelli sampling
+    :param kl_dict: dictionary of the KL decomposition to predict the outputs from the KL coefficients
+    :param dtype: data type of the samples (float32 halves their memory)
+    :param chunk_size: number of base samples predicted at a time, with the estimators updated from running sums
+        so the memory does not depend on sample_size, all at once if None
+    :param number_bootstrap: number of bootstrap replicates of the confidence intervals, see bootstrap_sensitivities,
+        not computed if 0 (the samples are needed, so chunk_size must be None)
+    :param confidence: confidence level of the bootstrap intervals
+    :param n_workers: number of processes to use for the bootstrap replicates, serially if 1
+    :param seed: seed of the bootstrap resampling, for reproducible intervals
+    :return: dictionary of the main, total and joint sensitivities of each output point to each variable
+        (and their bootstrap intervals), and the model values at the samples (None if chunk_size is given)
+    """
+
+    SensMethod = sobol(variable_matrix)
+    variable_names, aggregation = scheme_aggregation(variable_matrix)
+
+    if chunk_size is not None:
+        if number_bootstrap > 0:
+            raise ValueError('bootstrap intervals need all the samples, so chunk_size must be None')
+        for xsam in SensMethod.sample_chunks(sample_size, chunk_size, dtype=dtype):
+            SensMethod.accumulate(surrogate_model_predict(surrogate_model, xsam, kl_dict=kl_dict))
+        sens_dict = _variable_sensitivities(SensMethod.compute_accumulated(), aggregation)
+        sens_dict['variable_names'] = variable_names
+        return sens_dict, None
+
+    # get the sensitivity sample matrix (dtype='float32' halves the memory of the samples)
+    xsam = SensMethod.sample(sample_size, dtype=dtype)
+    # evaluate the surrogate model at the samples
+    ysam = surrogate_model_predict(surrogate_model, xsam, kl_dict=kl_dict)
+    if ysam.ndim == 1:
+        ysam = ysam.reshape(-1, 1)
+
+    sens_dict = _block_sensitivities(SensMethod, ysam, aggregation)
+    sens_dict['variable_names'] = variable_names
+
+    if number_bootstrap > 0:
+        sens_dict.update(
+            bootstrap_sensitivities(
+                ysam,
+                variable_matrix,
+                number_bootstrap=number_bootstrap,
+                confidence=confidence,
+                n_workers=n_workers,
+                seed=seed,
+                sens_dict=sens_dict,
+            )
+        )
+
+    return sens_dict, ysam
+
+
+def bootstrap_sensitivities(
+    ysam,
+    variable_matrix,
+    number_bootstrap=100,
+    confidence=BOOTSTRAP_CONFIDENCE,
+    n_workers=1,
+    seed=None,
+    sens_dict=None,
+):
+    """
+    Bootstrap confidence intervals of the Sobol indices from the model values already evaluated
+    at the samples: each replicate resamples the base samples with replacement, keeping the rows
+    of the sam1, sam2 and mixed samples of a base sample together, and computes the indices again.
+
+    :param ysam: model values at the samples from compute_sensitivities (samples x points)
+    :param variable_matrix: transformed perturbation matrix (run x scheme) the surrogate was trained on
+    :param number_bootstrap: number of bootstrap replicates
+    :param confidence: confidence level of the intervals
+    :param n_workers: number of processes to use for the replicates, serially if 1
+    :param seed: seed of the resampling, for reproducible intervals
+    :param sens_dict: sensitivities of the samples from compute_sensitivities, computed if None
+    :return: dictionary of the lower and upper bounds (2 x points x variables...) of the main, total
+        and joint sensitivities ("main_ci", "total_ci", "jointt_ci"), and the fraction of replicates that
+        rank the variables by total sensitivity as the samples do ("total_rank_agreement", points)
+    """
+
+    SensMethod = sobol(variable_matrix)
+    SensMethod.nsam = ysam.shape[0]
+    ysam = asarray(ysam).reshape(SensMethod.nsam, -1)
+    variable_names, aggregation = scheme_aggregation(variable_matrix)
+    if sens_dict is None:
+        sens_dict = _block_sensitivities(SensMethod, ysam, aggregation)
+
+    number_workers = max(min(n_workers or 1, number_bootstrap), 1)
+    bootstrap = partial(
+        _bootstrap_replicates, SensMethod=SensMethod, ysam=ysam, aggregation=aggregation
+    )
+    # one seed per replicate, so the replicates do not depend on the number of workers
+    seeds = random.SeedSequence(seed).spawn(number_bootstrap)
+    seed_batches = [
+        seeds[batch[0] : batch[-1] + 1]
+        for batch in array_split(arange(number_bootstrap), number_workers)
+    ]
+
+    if number_workers == 1:
+        batches = [bootstrap(seeds)]
+    else:
+        with ProcessPoolExecutor(max_workers=number_workers) as executor:
+            batches = list(executor.map(bootstrap, seed_batches))
+
+    tail = 50 * (1 - confidence)
+    intervals = {}
+    for key in ['main', 'total', 'jointt']:
+        values = concatenate([batch[key] for batch in batches])
+        intervals[f'{key}_ci'] = percentile(values, [tail, 100 - tail], axis=0)
+
+    ranking = argsort(-sens_dict['total'], axis=-1)
+    rank_agreement = [
+        (argsort(-batch['total'], axis=-1) == ranking).all(axis=-1) for batch in batches
+    ]
+    intervals['total_rank_agreement'] = concatenate(rank_agreement).mean(axis=0)
+
+    return intervals
+
+
+def _bootstrap_replicates(seeds, SensMethod, ysam, aggregation):
+    """
+    :param seeds: seed of the resampling of each bootstrap replicate
+    :param SensMethod: sobol method of the samples
+    :param ysam: model values at the samples (samples x points)
+    :param aggregation: aggregation matrix (variable x scheme) from scheme_aggregation
+    :return: dictionary of the main, total and joint sensitivities of the replicates (replicates x points x variables...)
+    """
+
+    ninit = SensMethod.nsam // (SensMethod.dim + 2)
+    base = stack([random.default_rng(seed).integers(ninit, size=(1, ninit)) for seed in seeds])
+    # rows of the resampled base samples in each of the dim + 2 sample blocks (replicates x samples)
+    rows = (arange(SensMethod.dim + 2)[:, None] * ninit + base).reshape(len(seeds), -1)
+
+    replicates = [
+        _block_sensitivities(SensMethod, ysam[replicate], aggregation) for replicate in rows
+    ]
+    return {
+        key: stack([replicate[key] for replicate in replicates])
+        for key in ['main', 'total', 'jointt']
+    }
+
+
+def _block_sensitivities(SensMethod, ysam, aggregation):
+    """
+    :param SensMethod: sobol method of the samples
+    :param ysam: model values at the samples (samples x points)
+    :param aggregation: aggregation matrix (variable x scheme) from scheme_aggregation
+    :return: dictionary of the main, total and joint sensitivities (points x variables...),
+        computed for blocks of output points at a time
+    """
+
+    npts = ysam.shape[1]
+    ndim = aggregation.shape[0]
     sens_dict = {
         'main': zeros((npts, ndim)),
         'total': zeros((npts, ndim)),
         'jointt': zeros((npts, ndim, ndim)),
-        'variable_names': variable_names,
     }
-    for i in range(npts):
-        sens = SensMethod.compute(ysam[:, i] - ysam[:,i].mean())
-        vdx = -1
-        variable_prior = ''
-        for sdx, scheme in enumerate(variable_matrix['scheme']):
-            variable_name = PerturbedVariable.class_from_scheme_name(scheme).name
-            if variable_name != variable_prior:
-                vdx += 1
-            variable_prior = variable_name
-            sens_dict['main'][i, vdx] += sens['main'][sdx]
-            sens_dict['total'][i, vdx] += sens['total'][sdx]
-            # go in one loop further for joint sensitivities
-            vdxx = -1
-            variable_priorr = ''
-            for sdxx, schemee in enumerate(variable_matrix['scheme']):
-                variable_namee = PerturbedVariable.class_from_scheme_name(schemee).name
-                if variable_namee != variable_priorr:
-                    vdxx += 1
-                variable_priorr = variable_namee
-                if vdx == vdxx: # add internal parameterizations interactions to main effect
-                   sens_dict['main'][i, vdx] += sens['jointt'][sdx, sdxx]
-                else:
-                   sens_dict['jointt'][i, vdx, vdxx] += sens['jointt'][sdx, sdxx]
-
-
-    return sens_dict, ysam
+    # all the output points of a block at once
+    block_points = max(SENSITIVITY_BLOCK_SIZE // (ysam.shape[0] * (SensMethod.dim + 1)), 1)
+    for first in range(0, npts, block_points):
+        points = slice(first, min(first + block_points, npts))
+        sens = SensMethod.compute(ysam[:, points] - ysam[:, points].mean(axis=0))
+        for key, values in _variable_sensitivities(sens, aggregation).items():
+            sens_dict[key][points] = values
+
+    return sens_dict
+
+
+def _variable_sensitivities(sens, aggregation):
+    """
+    :param sens: scheme indices from sobol.compute (schemes x points)
+    :param aggregation: aggregation matrix (variable x scheme) from scheme_aggregation
+    :return: dictionary of the main, total and joint indices of the variables (points x variables)
+    """
+    ndim = aggregation.shape[0]
+    main = matmul(aggregation, sens['main']).T
+    total = matmul(aggregation, sens['total']).T
+    # joint indices of the schemes of two variables, internal parameterizations
+    # interactions (the same variable) are added to the main effect
+    joint = einsum('vs,stp,wt->pvw', aggregation, sens['jointt'], aggregation)
+    main += diagonal(joint, axis1=1, axis2=2)
+    joint[:, arange(ndim), arange(ndim)] = 0
+    return {'main': main, 'total': total, 'jointt': joint}
 
 
 def plot_sens(
@@ -180,6 +461,7 @@ def plot_sens(
     maxlegendcol=4,
 ):
     """Plots sensitivity for multiple observables"""
+    import matplotlib.pyplot as plt
 
     ncases = sensdata.shape[0]
     npar = sensdata.shape[1]
@@ -0,0 +1,200 @@
+from numpy import (
+    abs,
+    argmax,
+    arange,
+    array,
+    cumsum,
+    dot,
+    empty,
+    memmap,
+    searchsorted,
+    sign,
+    sqrt,
+    zeros,
+)
+from numpy.linalg import eigh
+from surrogate.utils import inverse_kl
+
+
+class StreamingKL:
+    """
+    KL (PCA) decomposition of the ensemble matrix (runs x features) that only
+    holds a chunk of features in memory at a time, using the method of snapshots:
+    the (runs x runs) Gram matrix of the centered ensemble is accumulated over the
+    chunks and its eigenvectors give the eigenmodes, chunk by chunk, in a second pass.
+    Gives the same decomposition as sklearn.decomposition.PCA(whiten=True), with the
+    eigenmodes and eigenvalues named as in the kl_dict.
+    """
+
+    def __init__(self, n_components=None, chunk_size: int = 100000, dtype=float):
+        """
+        :param n_components: number of eigenmodes to keep (int), fraction of the variance to explain (float < 1), or all (runs - 1) if None
+        :param chunk_size: number of features (or times, for arrays with more than 2 dimensions) per chunk
+        :param dtype: data type of the eigenmodes and mean vector, the Gram matrix is always double precision
+        """
+        self.n_components = n_components
+        self.chunk_size = chunk_size
+        self.dtype = dtype
+
+    def _chunks(self, Y):
+        """
+        :param Y: ensemble array-like (runs x features), or (runs x time x space...) chunked along time,
+            e.g., a numpy memmap, netCDF4 variable or the lazy DataArray of preprocessing.store.read_ensemble_store
+        :return: generator of the feature slices and the ensemble values in them (runs x chunk features)
+        """
+        first_feature = 0
+        for start in range(0, Y.shape[1], self.chunk_size):
+            # copy, as the chunk is centered in place
+            chunk = array(Y[:, start : start + self.chunk_size], dtype=float)
+            chunk = chunk.reshape(chunk.shape[0], -1)
+            yield slice(first_feature, first_feature + chunk.shape[1]), chunk
+            first_feature += chunk.shape[1]
+
+    def fit(self, Y, eigenmodes_filename=None):
+        """
+        :param Y: ensemble array-like (runs x features), or (runs x time x space...) chunked along time
+        :param eigenmodes_filename: memory-mapped file for the eigenmodes, kept in memory if None
+        :return: self
+        """
+
+        nruns = Y.shape[0]
+
+        # first pass: mean vector and Gram matrix of the centered ensemble
+        mean_chunks = []
+        gram = zeros((nruns, nruns))
+        for features, chunk in self._chunks(Y):
+            chunk_mean = chunk.mean(axis=0)
+            chunk -= chunk_mean
+            gram += dot(chunk, chunk.T)
+            mean_chunks.append(chunk_mean)
+        n_features = sum(len(chunk_mean) for chunk_mean in mean_chunks)
+        self.n_features_ = n_features
+        self.mean_ = empty(n_features, dtype=self.dtype)
+        first_feature = 0
+        for chunk_mean in mean_chunks:
+            self.mean_[first_feature : first_feature + len(chunk_mean)] = chunk_mean
+            first_feature += len(chunk_mean)
+
+        # eigenvalues of the Gram matrix are the squared singular values of the ensemble
+        singular_squared, left_vectors = eigh(gram)
+        order = singular_squared.argsort()[::-1]
+        singular_squared = singular_squared[order].clip(min=0)
+        left_vectors = left_vectors[:, order]
+
+        total_variance = singular_squared.sum() / (nruns - 1)
+        explained_variance = singular_squared / (nruns - 1)
+        explained_variance_ratio = explained_variance / total_variance
+        neig = self._number_of_components(explained_variance_ratio, nruns)
+
+        self.n_components_ = neig
+        self.explained_variance_ = explained_variance[0:neig]
+        self.explained_variance_ratio_ = explained_variance_ratio[0:neig]
+        self.singular_values_ = sqrt(singular_squared[0:neig])
+        self._left_vectors = left_vectors[:, 0:neig]
+
+        # second pass: eigenmodes (right singular vectors), chunk by chunk
+        if eigenmodes_filename is None:
+            self.components_ = empty((neig, n_features), dtype=self.dtype)
+        else:
+            self.components_ = memmap(
+                eigenmodes_filename, dtype=self.dtype, mode='w+', shape=(neig, n_features)
+            )
+        largest_mode_value = zeros(neig)
+        for features, chunk in self._chunks(Y):
+            chunk -= self.mean_[features]
+            modes = dot(self._left_vectors.T, chunk) / self.singular_values_[:, None]
+            self.components_[:, features] = modes
+            chunk_largest = modes[arange(neig), argmax(abs(modes), axis=1)]
+            larger = abs(chunk_largest) > abs(largest_mode_value)
+            largest_mode_value[larger] = chunk_largest[larger]
+
+        # same sign convention as sklearn: the largest value of each eigenmode is positive
+        mode_sign = sign(largest_mode_value)
+        mode_sign[mode_sign == 0] = 1
+        self.components_ *= mode_sign[:, None]
+        self._left_vectors = self._left_vectors * mode_sign
+
+        return self
+
+    def _number_of_components(self, explained_variance_ratio, nruns: int) -> int:
+        """
+        :param explained_variance_ratio: explained variance ratio of all the eigenmodes
+        :param nruns: number of runs in the ensemble
+        :return: number of eigenmodes to keep
+        """
+        if self.n_components is None:
+            return nruns - 1
+        elif 0 < self.n_components < 1:
+            return int(
+                searchsorted(cumsum(explained_variance_ratio), self.n_components, side='right') + 1
+            )
+        elif self.n_components >= nruns:
+            raise ValueError(
+                f'n_components={self.n_components} must be less than the number of runs {nruns}'
+            )
+        return int(self.n_components)
+
+    @property
+    def klxi_(self):
+        """whitened KL coefficients of the fitted ensemble (runs x eigenmodes)"""
+        return self._left_vectors * sqrt(self._left_vectors.shape[0] - 1)
+
+    @property
+    def kl_dict(self) -> dict:
+        """dictionary of the decomposition used by surrogate.utils.surrogate_model_predict"""
+        return {
+            'eigenmodes': self.components_,
+            'eigenvalues': self.explained_variance_,
+            'mean_vector': self.mean_,
+        }
+
+    def transform(self, Y):
+        """
+        :param Y: ensemble array-like (runs x features), or (runs x time x space...) chunked along time
+        :return: whitened KL coefficients (runs x eigenmodes)
+        """
+        klxi = zeros((Y.shape[0], self.n_components_))
+        for features, chunk in self._chunks(Y):
+            chunk -= self.mean_[features]
+            klxi += dot(chunk, self.components_[:, features].T)
+        return klxi / sqrt(self.explained_variance_)
+
+    def inverse_transform(self, klxi):
+        """
+        :param klxi: whitened KL coefficients (runs x eigenmodes)
+        :return: ensemble (runs x features)
+        """
+        return inverse_kl(self.components_, self.explained_variance_, klxi, self.mean_)
+
+
+def single_precision_check(Y, n_components=None, chunk_size: int = 100000) -> dict:
+    """
+    Accuracy check of the single-precision (float32) KL decomposition of an ensemble against
+    the double-precision (float64) one, e.g., before extracting and decomposing in float32.
+    The ensemble is rounded to float32, as it would be when extracted in single precision, and
+    the eigenmodes, mean vector and reconstruction are float32, while the Gram matrix and its
+    eigenvectors are double precision in both, as in StreamingKL. The neural network surrogate
+    and the sensitivity samples are not checked.
+
+    :param Y: ensemble array-like (runs x features), or (runs x time x space...) chunked along time
+    :param n_components: number of eigenmodes to keep, see StreamingKL
+    :param chunk_size: number of features (or times) per chunk
+    :return: dictionary of the maximum relative error of the eigenvalues and of the KL
+        coefficients, and the maximum absolute error of the reconstructed ensemble and the
+        mean absolute KL truncation error (in the units of Y) for comparison
+    """
+
+    kl64 = StreamingKL(n_components, chunk_size=chunk_size, dtype='float64').fit(Y)
+    Y32 = array(Y, dtype='float32')
+    kl32 = StreamingKL(kl64.n_components_, chunk_size=chunk_size, dtype='float32').fit(Y32)
+
+    reconstruction64 = kl64.inverse_transform(kl64.klxi_)
+    reconstruction32 = kl32.inverse_transform(kl32.klxi_.astype('float32'))
+    Y64 = array(Y, dtype=float).reshape(Y.shape[0], -1)
+
+    return {
+        'eigenvalues': float(abs(kl32.explained_variance_ / kl64.explained_variance_ - 1).max()),
+        'klxi': float(abs(kl32.klxi_ - kl64.klxi_).max() / abs(kl64.klxi_).max()),
+        'reconstruction': float(abs(reconstruction32 - reconstruction64).max()),
+        'truncation': float(abs(reconstruction64 - Y64).mean()),
+    }
@@ -1,9 +1,7 @@
 import copy
+import math
 import torch
-import matplotlib.pyplot as plt
-from numpy import setdiff1d
-
-torch.set_default_dtype(torch.double)
+from numpy import dtype as numpy_dtype, setdiff1d
 
 
 def weighted_loss(loss, y_pred, y_true, eigenratio):
@@ -32,11 +30,15 @@ def make_nn_surrogate_model(
     seed: int = None,
     freq_out: int = 100,
     freq_plot: int = 1000,
+    dtype='float64',
 ):
 
     if seed is not None:
         torch.manual_seed(seed)
 
+    # precision of the network parameters and training tensors, e.g., 'float32'
+    torch_dtype = torch_dtype_from(dtype)
+
     nens, ndim = train_X.shape
     nens_, neig = train_Y.shape
     assert nens == nens_
@@ -61,7 +63,15 @@ def make_nn_surrogate_model(
             print(f'  Train: index={train_indices}')
             print(f'  Test:  index={test_indices}')
             surrogate_model.append(
-                MLP(ndim, neig, hidden_layers, dropout=dropout, activ=activ, bnorm=False)
+                MLP(
+                    ndim,
+                    neig,
+                    hidden_layers,
+                    dropout=dropout,
+                    activ=activ,
+                    bnorm=False,
+                    dtype=torch_dtype,
+                )
             )
             results = surrogate_model[i].fit(
                 train_X[train_indices, :],
@@ -74,12 +84,12 @@ def make_nn_surrogate_model(
                 gradcheck=False,
                 freq_out=freq_out,
                 freq_plot=freq_plot,
-                eigenratio=tch(eigenratio),
+                eigenratio=tch(eigenratio, dtype=torch_dtype),
             )
 
     else:
         surrogate_model = MLP(
-            ndim, neig, hidden_layers, dropout=dropout, activ=activ, bnorm=False
+            ndim, neig, hidden_layers, dropout=dropout, activ=activ, bnorm=False, dtype=torch_dtype
         )
         results = surrogate_model.fit(
             train_X,
@@ -92,16 +102,26 @@ def make_nn_surrogate_model(
             gradcheck=False,
             freq_out=freq_out,
             freq_plot=freq_plot,
-            eigenratio=tch(eigenratio),
+            eigenratio=tch(eigenratio, dtype=torch_dtype),
         )
 
     return surrogate_model
 
 
-def tch(arr, device='cpu'):
+def torch_dtype_from(dtype):
+    """
+    :param dtype: numpy data type (or name), or torch data type
+    :return: the torch data type
+    """
+    if isinstance(dtype, torch.dtype):
+        return dtype
+    return getattr(torch, numpy_dtype(dtype).name)
+
+
+def tch(arr, device='cpu', dtype=torch.double):
     # return torch.from_numpy(arr.astype(np.double)).to(device)
     # x = torch.from_numpy(arr).double()
-    x = torch.tensor(arr, requires_grad=True)
+    x = torch.tensor(arr, dtype=dtype, requires_grad=True)
     return x
 
 
@@ -147,14 +167,15 @@ class Sine(torch.nn.Module):
         """
         Forward pass of the function.
         """
-        return torch.sin(2.0 * torch.tensor(math.pi) * input)
+        return torch.sin(2.0 * torch.tensor(math.pi, dtype=input.dtype) * input)
 
 
 class MLPBase(torch.nn.Module):
-    def __init__(self, indim, outdim):
+    def __init__(self, indim, outdim, dtype=torch.double):
         super(MLPBase, self).__init__()
         self.indim = indim
         self.outdim = outdim
+        self.dtype = dtype
         # TODO: in mpnn/utils_quinn.py, I needed to comment this out!!
         # self.model = None
         return
@@ -171,9 +192,9 @@ class MLPBase(torch.nn.Module):
 
     def predict(self, x, best=True):
         if best:
-            return npy(self.best_instance(tch(x)))
+            return npy(self.best_instance(tch(x, dtype=self.dtype)))
         else:
-            return npy(self.forward(tch(x)))
+            return npy(self.forward(tch(x, dtype=self.dtype)))
 
     def numpar(self):
         pdim = sum(p.numel() for p in self.parameters())
@@ -243,8 +264,8 @@ class MLPBase(torch.nn.Module):
             else:
                 batch_size = ntrn // (num_batches - 1)
 
-        xtrn_ = tch(xtrn)
-        ytrn_ = tch(ytrn)
+        xtrn_ = tch(xtrn, dtype=self.dtype)
+        ytrn_ = tch(ytrn, dtype=self.dtype)
 
         # Validation data
         if val is None:
@@ -252,8 +273,8 @@ class MLPBase(torch.nn.Module):
         else:
             xval, yval = val
 
-        xval_ = tch(xval)
-        yval_ = tch(yval)
+        xval_ = tch(xval, dtype=self.dtype)
+        yval_ = tch(yval, dtype=self.dtype)
 
         # Training process
         self.best_fepoch = 0
@@ -356,6 +377,7 @@ class MLPBase(torch.nn.Module):
         return
 
     def plot_history(self):
+        import matplotlib.pyplot as plt
 
         tst_avail = False
         if len(self.history[0]) > 3:
@@ -428,6 +450,7 @@ class MLPBase(torch.nn.Module):
     def plot_1d_fits(
         self, xx_list, yy_list, domain=None, ngr=111, true_model=None, labels=None, colors=None
     ):
+        import matplotlib.pyplot as plt
 
         nlist = len(xx_list)
         assert nlist == len(yy_list)
@@ -505,8 +528,9 @@ class MLP(MLPBase):
         bnlearn=True,
         dropout=0.0,
         final_transform=None,
+        dtype=torch.double,
     ):
-        super(MLP, self).__init__(indim, outdim)
+        super(MLP, self).__init__(indim, outdim, dtype=dtype)
 
         self.nlayers = len(hls)
         assert self.nlayers > 0
@@ -539,31 +563,33 @@ class MLP(MLPBase):
             activ_fcn = torch.nn.Identity()
 
         modules = []
-        modules.append(torch.nn.Linear(self.indim, self.hls[0], self.biasorno))
+        modules.append(torch.nn.Linear(self.indim, self.hls[0], self.biasorno, dtype=dtype))
         if self.dropout > 0.0:
             modules.append(torch.nn.Dropout(p=self.dropout))
 
         if self.bnorm:
-            modules.append(torch.nn.BatchNorm1d(self.hls[0], affine=self.bnlearn))
+            modules.append(torch.nn.BatchNorm1d(self.hls[0], affine=self.bnlearn, dtype=dtype))
         for i in range(1, self.nlayers):
             modules.append(activ_fcn)
-            modules.append(torch.nn.Linear(self.hls[i - 1], self.hls[i], self.biasorno))
+            modules.append(
+                torch.nn.Linear(self.hls[i - 1], self.hls[i], self.biasorno, dtype=dtype)
+            )
             if self.dropout > 0.0:
                 modules.append(torch.nn.Dropout(p=self.dropout))
             if self.bnorm:
-                modules.append(torch.nn.BatchNorm1d(self.hls[i], affine=self.bnlearn))
+                modules.append(torch.nn.BatchNorm1d(self.hls[i], affine=self.bnlearn, dtype=dtype))
 
         modules.append(activ_fcn)
-        modules.append(torch.nn.Linear(self.hls[-1], self.outdim, bias=self.biasorno))
+        modules.append(torch.nn.Linear(self.hls[-1], self.outdim, bias=self.biasorno, dtype=dtype))
         if self.dropout > 0.0:
             modules.append(torch.nn.Dropout(p=self.dropout))
         if self.bnorm:
-            modules.append(torch.nn.BatchNorm1d(self.outdim, affine=self.bnlearn))
+            modules.append(torch.nn.BatchNorm1d(self.outdim, affine=self.bnlearn, dtype=dtype))
 
         if self.final_transform == 'exp':
             modules.append(Expon())
 
-        self.nnmodel = torch.nn.Sequential(*modules)
+        self.nnmodel = torch.nn.Sequential(*modules).to(dtype)
 
     def forward(self, x):
         return self.nnmodel(x)
@@ -1,7 +1,5 @@
-from numpoly import ndpoly
+import sys
 from numpy import (
-    stack,
-    sum,
     sqrt,
     dot,
     empty,
@@ -14,25 +12,23 @@ def inverse_kl(eigenmodes, eigenvalues, samples, mean_vector):
     neig = eigenvalues.shape[0]
     if samples.ndim == 1:
        samples = samples.reshape(1,-1)
-    y_out = sum(
-        stack(
-            [
-                dot(
-                    (samples * sqrt(eigenvalues))[:, mode_index, None],
-                    eigenmodes[None, mode_index, :],
-                )
-                for mode_index in range(neig)
-            ],
-            axis=0,
-        ),
-        axis=0,
+    # sum over the modes as one product, in the precision of the eigenmodes
+    y_out = dot(
+        (samples[:, 0:neig] * sqrt(eigenvalues)).astype(eigenmodes.dtype, copy=False),
+        eigenmodes[0:neig, :],
     )
     y_out += mean_vector
     return y_out
 
 
+def is_polynomial(surrogate_model):
+    # a polynomial can only exist once numpoly has been imported, so it is not imported here
+    numpoly = sys.modules.get('numpoly')
+    return numpoly is not None and type(surrogate_model) is numpoly.ndpoly
+
+
 def surrogate_model_predict(surrogate_model, X_values, kl_dict=None):
-    if type(surrogate_model) is ndpoly:
+    if is_polynomial(surrogate_model):
         Y_values = surrogate_model(*X_values.T).T
     elif type(surrogate_model) == list:
         n_folds = len(surrogate_model)
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from scipy.stats import qmc
+from wrf_fvcom.design import (
+    CenteredDiscrepancy,
+    DesignCriterion,
+    optimize_design_once,
+    optimized_design,
+    unit_levels,
+)
+from wrf_fvcom.variables import (
+    FVCOM_Prandtl,
+    FVCOM_SWRadiationAbsorption,
+    FVCOM_VerticalMixing,
+    WRF_MP,
+    WRF_PBL_SFCLAY,
+)
+
+VARIABLES = [
+    WRF_PBL_SFCLAY,
+    WRF_MP,
+    FVCOM_VerticalMixing,
+    FVCOM_SWRadiationAbsorption,
+    FVCOM_Prandtl,
+]
+
+
+def test_design_keeps_balanced_levels_and_strata():
+    perturbations = optimized_design(
+        VARIABLES, 12, number_restarts=2, number_iterations=200, seed=3
+    ).values
+
+    for vdx, variable in enumerate(VARIABLES[0:3]):
+        levels, counts = np.unique(perturbations[:, vdx], return_counts=True)
+        np.testing.assert_array_equal(
+            levels, np.arange(variable.lower_bound, variable.upper_bound + 1)
+        )
+        assert (counts == 12 // len(levels)).all()
+    for vdx, variable in enumerate(VARIABLES[3:5], start=3):
+        unit_column = variable.chaospy_distribution().fwd(perturbations[:, vdx])
+        np.testing.assert_array_equal(np.sort(np.floor(unit_column * 12)), np.arange(12))
+
+
+def test_design_is_reproducible_with_the_workers():
+    serial = optimized_design(VARIABLES, 12, number_restarts=3, number_iterations=100, seed=5)
+    parallel = optimized_design(
+        VARIABLES, 12, number_restarts=3, number_iterations=100, n_workers=2, seed=5
+    )
+    np.testing.assert_array_equal(serial.values, parallel.values)
+
+
+def test_discrepancy_of_the_optimized_design():
+    levels = unit_levels(VARIABLES, 16)
+    criterion = CenteredDiscrepancy(16)
+    seed = np.random.SeedSequence(7)
+
+    initial_value, initial_design = optimize_design_once(seed, levels, criterion, 0)
+    value, design = optimize_design_once(seed, levels, criterion, 500)
+    # the criterion is updated with the terms of the exchanged points only, scipy gives its square
+    assert value == pytest.approx(np.sqrt(qmc.discrepancy(design, method='CD')))
+    assert initial_value == pytest.approx(np.sqrt(qmc.discrepancy(initial_design, method='CD')))
+    assert value < initial_value
+
+
+def test_criterion_needs_pair_terms():
+    with pytest.raises(TypeError):
+        DesignCriterion()
@@ -0,0 +1,28 @@
+import numpy as np
+from surrogate.gsa import bootstrap_sensitivities, sobol
+from wrf_fvcom.perturb import SampleRule, perturb_variables, transform_perturbation_matrix
+from wrf_fvcom.variables import FVCOM_Prandtl, FVCOM_SWRadiationAbsorption, WRF_MP
+
+
+def test_bootstrap_does_not_depend_on_the_number_of_workers():
+    variable_matrix = transform_perturbation_matrix(
+        perturb_variables(
+            [WRF_MP, FVCOM_SWRadiationAbsorption, FVCOM_Prandtl], 18, SampleRule.KOROBOV
+        )
+    )
+    np.random.seed(0)
+    xsam = sobol(variable_matrix).sample(200)
+    ysam = np.sin(xsam @ np.random.default_rng(0).normal(size=(xsam.shape[1], 3)))
+
+    serial, parallel = [
+        bootstrap_sensitivities(
+            ysam, variable_matrix, number_bootstrap=10, n_workers=n_workers, seed=4
+        )
+        for n_workers in (1, 3)
+    ]
+
+    assert serial['total_ci'].shape == (2, 3, 3)
+    assert serial['jointt_ci'].shape == (2, 3, 3, 3)
+    assert (serial['total_ci'][0] <= serial['total_ci'][1]).all()
+    for key in serial:
+        np.testing.assert_array_equal(serial[key], parallel[key])
@@ -0,0 +1,49 @@
+import numpy as np
+from sklearn.decomposition import PCA
+from surrogate.kl import StreamingKL, single_precision_check
+
+
+def low_rank_ensemble(nruns=20, nfeatures=500, rank=5, seed=0):
+    """
+    :return: ensemble (runs x features) of daily temperature like values of a few modes
+    """
+
+    rng = np.random.default_rng(seed)
+    modes = rng.normal(size=(rank, nfeatures))
+    return 15 + rng.normal(size=(nruns, rank)) @ modes + 1e-3 * rng.normal(size=(nruns, nfeatures))
+
+
+def test_streaming_kl_matches_pca():
+    Y = low_rank_ensemble()
+    kl = StreamingKL(n_components=5, chunk_size=64).fit(Y)
+    pca = PCA(n_components=5, whiten=True).fit(Y)
+
+    np.testing.assert_allclose(kl.explained_variance_, pca.explained_variance_, rtol=1e-10)
+    np.testing.assert_allclose(np.abs(kl.components_), np.abs(pca.components_), atol=1e-10)
+    np.testing.assert_allclose(kl.inverse_transform(kl.klxi_), Y, atol=1e-2)
+
+
+def test_float32_kl_is_close_to_float64():
+    Y = low_rank_ensemble()
+    kl32 = StreamingKL(n_components=5, chunk_size=64, dtype='float32').fit(Y.astype('float32'))
+    assert kl32.components_.dtype == np.float32
+    assert kl32.inverse_transform(kl32.klxi_.astype('float32')).dtype == np.float32
+
+    errors = single_precision_check(Y, n_components=5, chunk_size=64)
+    assert errors['eigenvalues'] < 1e-5
+    assert errors['klxi'] < 1e-4
+    # single-precision rounding of values around 15 is O(1e-6)
+    assert errors['reconstruction'] < 1e-4
+    assert errors['reconstruction'] < errors['truncation']
+
+
+def test_variance_fraction_hit_exactly_keeps_the_same_components_as_pca():
+    Y = low_rank_ensemble()
+    # thresholds equal to the cumulative explained variance ratio of three eigenmodes, which are not
+    # more than the fraction, so a fourth is kept
+    kl_threshold = np.cumsum(StreamingKL(chunk_size=64).fit(Y).explained_variance_ratio_)[2]
+    pca_threshold = np.cumsum(PCA().fit(Y).explained_variance_ratio_)[2]
+
+    kl = StreamingKL(n_components=kl_threshold, chunk_size=64).fit(Y)
+    pca = PCA(n_components=pca_threshold, whiten=True).fit(Y)
+    assert kl.n_components_ == pca.n_components_ == 4
@@ -0,0 +1,39 @@
+from preprocessing.manifest import RunManifest
+
+
+def test_runs_in_the_same_directory_have_their_own_manifest(tmp_path):
+    first_run = [tmp_path / f'run1_{hour:02d}' for hour in range(3)]
+    second_run = [tmp_path / f'run2_{hour:02d}' for hour in range(3)]
+    for fname in first_run + second_run:
+        fname.write_text(fname.name)
+    settings = {'output': 'daily'}
+
+    first_manifest = RunManifest(tmp_path / 'resume', first_run, settings)
+    second_manifest = RunManifest(tmp_path / 'resume', second_run, settings)
+    assert first_manifest.directory != second_manifest.directory
+
+    # the same run, extended with a new file
+    extended_run = first_run + [tmp_path / 'run1_03']
+    extended_run[-1].write_text(extended_run[-1].name)
+    assert RunManifest(tmp_path / 'resume', extended_run, settings).directory == (
+        first_manifest.directory
+    )
+
+
+def test_run_id_names_the_manifest(tmp_path):
+    file_list = [tmp_path / f'run_{hour:02d}' for hour in range(4)]
+    for fname in file_list:
+        fname.write_text(fname.name)
+    settings = {'output': 'daily'}
+
+    manifest = RunManifest(tmp_path / 'resume', file_list[0:2], settings, checkpoint_files=1)
+    for fname in file_list[0:2]:
+        manifest.append(fname)
+    manifest.flush()
+
+    extended = RunManifest(tmp_path / 'resume', file_list, settings, run_id='run')
+    assert extended.number_processed == 0
+    for fname in file_list[0:2]:
+        extended.append(fname)
+    extended.flush()
+    assert RunManifest(tmp_path / 'resume', file_list, settings, run_id='run').number_processed == 2
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from surrogate.nn_regression import MLPBase, make_nn_surrogate_model
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'float64'])
+def test_fit_and_predict_in_dtype(dtype, monkeypatch):
+    monkeypatch.setattr(MLPBase, 'plot_history', lambda self: None)
+    default_dtype = torch.get_default_dtype()
+
+    rng = np.random.default_rng(0)
+    train_X = rng.random((20, 3))
+    train_Y = np.c_[train_X.sum(axis=1), train_X[:, 0] * train_X[:, 1]]
+
+    surrogate_model = make_nn_surrogate_model(
+        train_X, train_Y, hidden_layers=[8], activ='sin', nepochs=20, seed=0, dtype=dtype
+    )
+    prediction = surrogate_model.predict(train_X)
+
+    assert all(
+        parameter.dtype == getattr(torch, dtype) for parameter in surrogate_model.parameters()
+    )
+    assert prediction.dtype == np.dtype(dtype)
+    assert prediction.shape == train_Y.shape
+    assert np.isfinite(prediction).all()
+    # the global default dtype of torch is not changed
+    assert torch.get_default_dtype() == default_dtype
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+from wrf_fvcom.perturb import SampleRule, perturb_variables, perturbation_chunks
+from wrf_fvcom.variables import (
+    FVCOM_Prandtl,
+    FVCOM_SWRadiationAbsorption,
+    FVCOM_VerticalMixing,
+    WRF_MP,
+    WRF_PBL_SFCLAY,
+)
+
+VARIABLES = [
+    WRF_PBL_SFCLAY,
+    WRF_MP,
+    FVCOM_VerticalMixing,
+    FVCOM_SWRadiationAbsorption,
+    FVCOM_Prandtl,
+]
+
+
+@pytest.mark.parametrize('sample_rule', [SampleRule.KOROBOV, SampleRule.SOBOL])
+def test_chunks_are_the_perturbations(sample_rule, tmp_path):
+    perturbations = perturb_variables(VARIABLES, 250, sample_rule)
+
+    chunks = list(perturbation_chunks(VARIABLES, 250, sample_rule, chunk_size=64))
+    assert [first for first, chunk in chunks] == [0, 64, 128, 192]
+    np.testing.assert_array_equal(np.concatenate([chunk for first, chunk in chunks]), perturbations)
+
+    written = perturb_variables(
+        VARIABLES, 250, sample_rule, output_directory=tmp_path, chunk_size=64
+    )
+    np.testing.assert_array_equal(written.values, perturbations.values)
+    written.close()
@@ -0,0 +1,88 @@
+import json
+import os
+import time
+from wrf_fvcom.scheduler import (
+    DONE,
+    EXIT_FILENAME,
+    FAILED,
+    PENDING,
+    RUNNING,
+    EnsembleScheduler,
+    LocalSubprocessBackend,
+)
+
+
+def write_members(directory, results):
+    """
+    :param directory: ensemble directory
+    :param results: command that ends each member, "true" or "false"
+    :return: list of the member directories
+    """
+
+    member_directories = []
+    for mdx, result in enumerate(results):
+        member_directory = directory / f'member_{mdx}'
+        member_directory.mkdir()
+        with open(member_directory / 'member.json', 'w') as fp:
+            json.dump({'run': mdx, 'result': result}, fp)
+        member_directories.append(member_directory)
+    return member_directories
+
+
+def test_scheduler_runs_up_to_max_concurrent_members(tmp_path):
+    results = ['true', 'false', 'true', 'true', 'false']
+    member_directories = write_members(tmp_path, results)
+
+    scheduler = EnsembleScheduler(
+        LocalSubprocessBackend(), member_directories, 'sleep 0.2; ${result}', max_concurrent=2
+    )
+    counts = scheduler.step()
+    assert counts == {PENDING: 3, RUNNING: 2, DONE: 0, FAILED: 0}
+
+    while counts[PENDING] > 0 or counts[RUNNING] > 0:
+        time.sleep(0.05)
+        counts = scheduler.step()
+        assert counts[RUNNING] <= 2
+    assert counts == {PENDING: 0, RUNNING: 0, DONE: 3, FAILED: 2}
+    for member_directory, result in zip(member_directories, results):
+        state = DONE if result == 'true' else FAILED
+        assert scheduler.status[str(member_directory)]['state'] == state
+        assert (member_directory / EXIT_FILENAME).read_text().strip() == (
+            '0' if result == 'true' else '1'
+        )
+
+
+def test_restarted_scheduler_gets_the_result_of_the_members(tmp_path):
+    results = ['true', 'false', 'true']
+    member_directories = write_members(tmp_path, results)
+
+    # stopped while the first two members run
+    scheduler = EnsembleScheduler(
+        LocalSubprocessBackend(), member_directories, 'sleep 0.5; ${result}', max_concurrent=2
+    )
+    assert scheduler.step()[RUNNING] == 2
+
+    restarted = EnsembleScheduler(
+        LocalSubprocessBackend(), member_directories, 'sleep 0.5; ${result}', max_concurrent=2
+    )
+    assert restarted.members(RUNNING) == [str(directory) for directory in member_directories[0:2]]
+    counts = restarted.run(poll_interval=0.1)
+    assert counts == {PENDING: 0, RUNNING: 0, DONE: 2, FAILED: 1}
+    assert restarted.members(FAILED) == [str(member_directories[1])]
+
+    # the failed member is run again by a new scheduler
+    with open(member_directories[1] / 'member.json', 'w') as fp:
+        json.dump({'run': 1, 'result': 'true'}, fp)
+    retried = EnsembleScheduler(
+        LocalSubprocessBackend(), member_directories, '${result}', max_concurrent=2
+    )
+    counts = retried.run(poll_interval=0.1, retry_failed=True)
+    assert counts == {PENDING: 0, RUNNING: 0, DONE: 3, FAILED: 0}
+
+
+def test_reused_process_id_is_not_taken_for_the_member(tmp_path):
+    [member_directory] = write_members(tmp_path, ['true'])
+
+    # the process id of the tests, which do not run in the member directory
+    job = {'pid': os.getpid(), 'directory': str(member_directory)}
+    assert LocalSubprocessBackend().poll(job) == FAILED
@@ -0,0 +1,41 @@
+import numpy as np
+import xarray as xr
+from preprocessing.store import ensemble_store_to_list, read_ensemble_store, write_ensemble_store
+
+
+def test_store_returns_the_types_of_the_extraction(tmp_path):
+    time = np.arange('2018-05-12', '2018-05-16', dtype='datetime64[D]').astype('datetime64[s]')
+    locations = [[time, np.arange(8.0).reshape(4, 2)], [time[1:], np.ones((3, 2))]]
+    # a time of the run where all the values are missing is kept
+    locations[0][1][2] = np.nan
+    fields = [
+        [
+            time,
+            xr.DataArray(
+                np.full((4, 2, 3), float(rdx)),
+                coords={
+                    'XLONG': (('south_north', 'west_east'), np.zeros((2, 3))),
+                    'XTIME': time[0],
+                },
+                dims=('time', 'south_north', 'west_east'),
+                name='T2',
+            ),
+        ]
+        for rdx in range(2)
+    ]
+    filename = tmp_path / 'ensemble.nc'
+    write_ensemble_store({'runs': ['a', 'b'], 'T2_buoy': locations, 'T2': fields}, filename)
+
+    read_locations = ensemble_store_to_list(read_ensemble_store(filename, 'T2_buoy'))
+    for (run_time, values), (read_time, read_values) in zip(locations, read_locations):
+        assert isinstance(read_values, np.ndarray)
+        np.testing.assert_array_equal(read_time, run_time)
+        np.testing.assert_array_equal(read_values, values)
+
+    read_fields = ensemble_store_to_list(read_ensemble_store(filename, 'T2'))
+    for (run_time, values), (read_time, read_values) in zip(fields, read_fields):
+        assert isinstance(read_values, xr.DataArray)
+        assert set(read_values.coords) == {'XLONG'}
+        assert read_values.dims == values.dims
+        np.testing.assert_array_equal(read_time, run_time)
+        np.testing.assert_array_equal(read_values.values, values.values)
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+import xarray as xr
+from preprocessing.manifest import CHECKPOINT_FILES
+from preprocessing.timeseries import ensemble_matrix, extract_daily_timeseries_global
+
+
+def write_wrf_hours(directory, day, hours):
+    """
+    :param directory: directory of the files
+    :param day: day of the files, e.g., "2018-05-12"
+    :param hours: hours of the day to write, one file each
+    :return: list of the file names
+    """
+
+    file_list = []
+    for hour in hours:
+        fname = str(directory / f'wrfcstm_d01_{day}_{hour:02d}:00:00')
+        xr.Dataset(
+            {
+                'T2': (('Time', 'south_north', 'west_east'), np.full((1, 2, 3), 273.15 + hour)),
+                'XLONG': (('Time', 'south_north', 'west_east'), np.zeros((1, 2, 3))),
+                'XLAT': (('Time', 'south_north', 'west_east'), np.zeros((1, 2, 3))),
+            }
+        ).to_netcdf(fname)
+        file_list.append(fname)
+    return file_list
+
+
+def test_resume_daily_global_without_finished_day(tmp_path):
+    # fewer hourly files than a checkpoint, so no day is recorded in the manifest
+    file_list = write_wrf_hours(tmp_path, '2018-05-12', range(0, 10))
+    assert len(file_list) < CHECKPOINT_FILES
+
+    for invocation in range(2):
+        [(times, values)] = extract_daily_timeseries_global(
+            [file_list], 'wrf', 'T2', resume_directory=tmp_path / 'resume'
+        )
+        assert len(times) == 0
+        assert values.shape == (0, 2, 3)
+
+
+def test_resume_daily_global_after_finished_day(tmp_path):
+    file_list = write_wrf_hours(tmp_path, '2018-05-12', range(0, 24))
+    file_list += write_wrf_hours(tmp_path, '2018-05-13', range(0, 5))
+
+    [(times, values)] = extract_daily_timeseries_global(
+        [file_list], 'wrf', 'T2', resume_directory=tmp_path / 'resume'
+    )
+    [(resumed_times, resumed_values)] = extract_daily_timeseries_global(
+        [file_list], 'wrf', 'T2', resume_directory=tmp_path / 'resume'
+    )
+
+    np.testing.assert_array_equal(times, [np.datetime64('2018-05-12T00:00:00')])
+    np.testing.assert_array_equal(resumed_times, times)
+    np.testing.assert_allclose(resumed_values, values)
+    np.testing.assert_allclose(values, 11.5)
+
+
+def test_resume_extracts_only_the_appended_files(tmp_path, monkeypatch):
+    file_list = write_wrf_hours(tmp_path, '2018-05-12', range(0, 24))
+    [(times, values)] = extract_daily_timeseries_global(
+        [file_list], 'wrf', 'T2', resume_directory=tmp_path / 'resume'
+    )
+
+    opened_files = []
+    open_dataset = xr.open_dataset
+
+    def recording_open_dataset(fname, *args, **kwargs):
+        opened_files.append(fname)
+        return open_dataset(fname, *args, **kwargs)
+
+    monkeypatch.setattr(xr, 'open_dataset', recording_open_dataset)
+
+    appended_files = write_wrf_hours(tmp_path, '2018-05-13', range(0, 24))
+    [(extended_times, extended_values)] = extract_daily_timeseries_global(
+        [file_list + appended_files], 'wrf', 'T2', resume_directory=tmp_path / 'resume'
+    )
+
+    assert opened_files == appended_files
+    np.testing.assert_array_equal(
+        extended_times, np.array(['2018-05-12', '2018-05-13'], dtype='datetime64[s]')
+    )
+    np.testing.assert_allclose(extended_values[0], values[0])
+    np.testing.assert_allclose(extended_values, 11.5)
+
+
+def test_ensemble_matrix_checks_the_times_of_the_runs():
+    time = np.arange('2018-05-12', '2018-05-16', dtype='datetime64[D]').astype('datetime64[s]')
+    run_list = [[time, np.arange(8.0).reshape(4, 2)], [time, np.ones((4, 2))]]
+
+    matrix, feature_time, feature_node = ensemble_matrix(run_list, time_start=time[1])
+    np.testing.assert_array_equal(matrix[0], np.arange(2.0, 8.0))
+    np.testing.assert_array_equal(feature_time, np.repeat(time[1:], 2))
+    np.testing.assert_array_equal(feature_node, [0, 1, 0, 1, 0, 1])
+
+    # the same number of times in the window, but one day later
+    run_list.append([time + np.timedelta64(1, 'D'), np.ones((4, 2))])
+    with pytest.raises(ValueError, match='model run 2'):
+        ensemble_matrix(run_list, time_start=time[1])
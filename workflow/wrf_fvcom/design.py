@@ -0,0 +1,304 @@
+import numpy as np
+import xarray as xr
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from os import PathLike
+from pathlib import Path
+from typing import List
+from wrf_fvcom.variables import PerturbedVariable, VariableDistribution
+
+# exponent of the phi_p criterion, large values approach the maximin distance
+PHI_P = 50
+
+# number of candidate exchanges scored together in each iteration
+NUMBER_CANDIDATES = 64
+
+
+class DesignCriterion(ABC):
+    """
+    Space-filling criterion of a design in the unit hypercube that is a sum over
+    the pairs of points and over the points, so exchanging the values of two points
+    in one column only changes the terms of those two points.
+    """
+
+    pair_weight = 1.0
+
+    @abstractmethod
+    def pair_terms(self, points: np.ndarray, design: np.ndarray) -> np.ndarray:
+        """
+        :param points: points (candidate x variable)
+        :param design: design (point x variable)
+        :return: terms of the pairs of each point with each design point (candidate x point)
+        """
+
+    def point_terms(self, points: np.ndarray) -> np.ndarray:
+        """
+        :param points: points (candidate x variable)
+        :return: terms of each point (candidate)
+        """
+        return np.zeros(len(points))
+
+    def constant(self, number_variables: int) -> float:
+        """
+        :param number_variables: number of variables of the design
+        :return: term that does not depend on the points
+        """
+        return 0.0
+
+    def value(self, total: float) -> float:
+        """
+        :param total: sum of the constant, pair and point terms
+        :return: criterion to minimize
+        """
+        return total
+
+
+class PhiP(DesignCriterion):
+    """phi_p criterion of Morris and Mitchell (1995): minimizing it maximizes the minimum distance"""
+
+    def __init__(self, p: int = PHI_P):
+        self.p = p
+
+    def pair_terms(self, points, design):
+        squared_distance = ((points[:, None, :] - design[None, :, :]) ** 2).sum(axis=-1)
+        with np.errstate(divide='ignore'):
+            return squared_distance ** (-self.p / 2)
+
+    def value(self, total):
+        return total ** (1 / self.p)
+
+
+class CenteredDiscrepancy(DesignCriterion):
+    """centered L2 discrepancy of Hickernell (1998)"""
+
+    def __init__(self, number_points: int):
+        self.number_points = number_points
+        self.pair_weight = 2.0 / number_points**2
+
+    def pair_terms(self, points, design):
+        center_points = np.abs(points - 0.5)[:, None, :]
+        center_design = np.abs(design - 0.5)[None, :, :]
+        return np.prod(
+            1
+            + 0.5 * center_points
+            + 0.5 * center_design
+            - 0.5 * np.abs(points[:, None, :] - design[None, :, :]),
+            axis=-1,
+        )
+
+    def point_terms(self, points):
+        center = np.abs(points - 0.5)
+        return (
+            np.prod(1 + center, axis=-1) / self.number_points**2
+            - 2.0 * np.prod(1 + 0.5 * center - 0.5 * center**2, axis=-1) / self.number_points
+        )
+
+    def constant(self, number_variables):
+        return (13 / 12) ** number_variables
+
+    def value(self, total):
+        return np.sqrt(max(total, 0.0))
+
+
+def design_criterion(criterion: str, number_points: int) -> DesignCriterion:
+    """
+    :param criterion: "maximin" (phi_p) or "discrepancy" (centered L2)
+    :param number_points: number of points in the design
+    :return: criterion object
+    """
+
+    if criterion == 'maximin':
+        return PhiP()
+    elif criterion == 'discrepancy':
+        return CenteredDiscrepancy(number_points)
+    else:
+        raise ValueError(f'{criterion} not recognized. must be "maximin" or "discrepancy"')
+
+
+def unit_levels(variables: List[PerturbedVariable], number_points: int) -> List[np.ndarray]:
+    """
+    :param variables: names of random variables we are perturbing
+    :param number_points: number of points in the design
+    :return: unit hypercube values each column of the design is a permutation of: the centers of
+        the levels of discrete variables in balanced counts, the Latin hypercube strata otherwise
+    """
+
+    levels = []
+    for variable in variables:
+        if variable.variable_distribution == VariableDistribution.DISCRETEUNIFORM:
+            number_levels = variable.upper_bound - variable.lower_bound + 1
+            column = (np.arange(number_points) % number_levels + 0.5) / number_levels
+        else:
+            column = (np.arange(number_points) + 0.5) / number_points
+        levels.append(np.sort(column))
+    return levels
+
+
+def optimize_design_once(
+    seed: np.random.SeedSequence,
+    levels: List[np.ndarray],
+    criterion: DesignCriterion,
+    number_iterations: int,
+    number_candidates: int = NUMBER_CANDIDATES,
+) -> tuple:
+    """
+    Optimizes a design by exchanging the values of two points in one column, so the
+    balanced levels (and Latin hypercube strata) are kept. Each iteration scores a batch of
+    random exchanges together and keeps the best one, which is accepted if it lowers the
+    criterion or is within a threshold that decreases to zero (threshold accepting).
+
+    :param seed: seed of the random design and exchanges
+    :param levels: values of each column from unit_levels
+    :param criterion: criterion to minimize
+    :param number_iterations: number of batches of exchanges
+    :param number_candidates: number of exchanges in each batch
+    :return: criterion value and optimized design (point x variable) in the unit hypercube
+    """
+
+    rng = np.random.default_rng(seed)
+    design = np.stack([rng.permutation(column) for column in levels], axis=1)
+    number_points, number_variables = design.shape
+
+    pair_terms = criterion.pair_terms(design, design)
+    np.fill_diagonal(pair_terms, 0)
+    point_terms = criterion.point_terms(design)
+
+    def criterion_total():
+        return (
+            criterion.constant(number_variables)
+            + criterion.pair_weight * np.triu(pair_terms).sum()
+            + point_terms.sum()
+        )
+
+    total = criterion_total()
+    best_total, best_design = total, design.copy()
+
+    threshold = 0.01 * total
+    rows = np.arange(number_candidates)
+    for iteration in range(number_iterations):
+        # candidate exchanges of two different values of a column
+        column = rng.integers(number_variables, size=number_candidates)
+        first = rng.integers(number_points, size=number_candidates)
+        second = (first + rng.integers(1, number_points, size=number_candidates)) % number_points
+        differ = design[first, column] != design[second, column]
+        if not differ.any():
+            continue
+        column, first, second = column[differ], first[differ], second[differ]
+        candidates = rows[0 : len(column)]
+
+        first_points = design[first].copy()
+        second_points = design[second].copy()
+        first_points[candidates, column] = design[second, column]
+        second_points[candidates, column] = design[first, column]
+
+        # the terms of the pair of exchanged points do not change
+        first_pairs = criterion.pair_terms(first_points, design)
+        second_pairs = criterion.pair_terms(second_points, design)
+        for pairs in (first_pairs, second_pairs):
+            pairs[candidates, first] = 0
+            pairs[candidates, second] = 0
+        change = criterion.pair_weight * (
+            first_pairs.sum(axis=1)
+            - pair_terms[first].sum(axis=1)
+            + pair_terms[first, second]
+            + second_pairs.sum(axis=1)
+            - pair_terms[second].sum(axis=1)
+            + pair_terms[second, first]
+        )
+        first_point_terms = criterion.point_terms(first_points)
+        second_point_terms = criterion.point_terms(second_points)
+        change += first_point_terms + second_point_terms - point_terms[first] - point_terms[second]
+
+        if np.isnan(change).all():
+            continue
+        best = np.nanargmin(change)
+        if change[best] < threshold * (1 - iteration / number_iterations) * rng.random():
+            index = [first[best], second[best]]
+            design[index] = [first_points[best], second_points[best]]
+            new_pairs = np.stack([first_pairs[best], second_pairs[best]])
+            new_pairs[:, index] = pair_terms[index][:, index]
+            pair_terms[index, :] = new_pairs
+            pair_terms[:, index] = new_pairs.T
+            point_terms[index] = [first_point_terms[best], second_point_terms[best]]
+            # summed again, as the phi_p terms of close points are too large to be subtracted
+            total = criterion_total()
+            if total < best_total:
+                best_total, best_design = total, design.copy()
+
+    return criterion.value(best_total), best_design
+
+
+def optimized_design(
+    variables: List[PerturbedVariable],
+    number_perturbations: int,
+    criterion: str = 'maximin',
+    number_restarts: int = 8,
+    number_iterations: int = 2000,
+    n_workers: int = 1,
+    seed: int = None,
+    output_directory: PathLike = None,
+) -> xr.DataArray:
+    """
+    Space-filling design of the perturbations: the discrete (scheme) variables take each
+    of their levels in balanced counts and the continuous variables form a Latin hypercube,
+    with the points spread by optimizing the criterion from several random starts.
+
+    :param variables: names of random variables we are perturbing
+    :param number_perturbations: number of perturbations for the ensemble
+    :param criterion: "maximin" (phi_p) or "discrepancy" (centered L2), computed in the unit hypercube
+    :param number_restarts: number of optimizations from different random designs, the best is kept
+    :param number_iterations: number of batches of exchanges in each optimization
+    :param n_workers: number of processes to use for the restarts, serially if 1
+    :param seed: seed of the random designs, for reproducible designs
+    :param output_directory: directory where to write the DataArray netcdf file, not written if None
+    :return: DataArray of the perturbation_matrix, as from wrf_fvcom.perturb.perturb_variables
+    """
+
+    levels = unit_levels(variables, number_perturbations)
+    optimize = partial(
+        optimize_design_once,
+        levels=levels,
+        criterion=design_criterion(criterion, number_perturbations),
+        number_iterations=number_iterations,
+    )
+    seeds = np.random.SeedSequence(seed).spawn(number_restarts)
+
+    if n_workers is None or n_workers <= 1 or number_restarts <= 1:
+        designs = [optimize(restart_seed) for restart_seed in seeds]
+    else:
+        with ProcessPoolExecutor(max_workers=min(n_workers, number_restarts)) as executor:
+            designs = list(executor.map(optimize, seeds))
+    value, unit_design = min(designs, key=lambda design: design[0])
+    print(f'{criterion} criterion of the best of {number_restarts} designs: {value}')
+
+    perturbation_matrix = np.empty(unit_design.shape)
+    for vdx, variable in enumerate(variables):
+        if variable.variable_distribution == VariableDistribution.DISCRETEUNIFORM:
+            number_levels = variable.upper_bound - variable.lower_bound + 1
+            perturbation_matrix[:, vdx] = variable.lower_bound + np.floor(
+                unit_design[:, vdx] * number_levels
+            )
+        else:
+            perturbation_matrix[:, vdx] = variable.chaospy_distribution().inv(unit_design[:, vdx])
+
+    run_names = [
+        f'{len(variables)}_variable_{criterion}_{index + 1}'
+        for index in range(0, number_perturbations)
+    ]
+    variable_names = [f'{variable.name}' for variable in variables]
+
+    perturbations = xr.DataArray(
+        data=perturbation_matrix,
+        coords={'run': run_names, 'variable': variable_names},
+        dims=('run', 'variable'),
+        name='perturbation_matrix',
+    )
+
+    if output_directory is not None:
+        perturbations.to_netcdf(
+            Path(output_directory)
+            / f'perturbation_matrix_{len(variables)}variables_{criterion}{number_perturbations}.nc'
+        )
+
+    return perturbations
@@ -1,12 +1,16 @@
-import chaospy
+from __future__ import annotations
+
 import xarray as xr
 import numpy as np
 from enum import Enum
 from os import PathLike
-from typing import List, Union
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator, List, Tuple, Union
 from wrf_fvcom.variables import PerturbedVariable, VariableDistribution
-from sklearn.preprocessing import OneHotEncoder
-from skopt.space import Categorical, Real
+
+# chaospy, skopt and the surrogate models are imported when first used
+if TYPE_CHECKING:
+    import chaospy
 
 
 class SampleRule(Enum):
@@ -16,8 +20,19 @@ class SampleRule(Enum):
     LATINHYPERCUBE = 'latin_hypercube'
 
 
+# base of the Korobov lattice, as in chaospy.create_korobov_samples
+KOROBOV_BASE = 17797
+
+# number of perturbations per block in the chunked mode
+CHUNK_SIZE = 100000
+
+# number of the highest scoring candidates kept per configuration to select
+CANDIDATES_PER_SELECTION = 50
+
+
 class TransformRule(Enum):
-    ONEHOT = OneHotEncoder()
+    # name of the equivalent sklearn.preprocessing class
+    ONEHOT = 'OneHotEncoder'
 
 
 def distribution_from_variables(
@@ -28,6 +43,8 @@ def distribution_from_variables(
     :return: chaospy joint distribution encompassing variables
     """
 
+    import chaospy
+
     return chaospy.J(
         *(variable.chaospy_distribution(normalize=normalize) for variable in variables)
     )
@@ -38,15 +55,33 @@ def perturb_variables(
     number_perturbations: int = 1,
     sample_rule: SampleRule = SampleRule.RANDOM,
     output_directory: PathLike = None,
+    chunk_size: int = None,
+    run_names: bool = False,
 ) -> xr.DataArray:
     """
     :param variables: names of random variables we are perturbing
     :param number_perturbations: number of perturbations for the ensemble
     :param sample_rule: rule for sampling the joint distribution (e.g., KOROBOV) see SampleRule class and chaospy docs
     :param output_directory: directory where to write the DataArray netcdf file, not written if None
-    :return: DataArray of the perturbation_matrix
+    :param chunk_size: number of perturbations sampled and written at a time (requires output_directory), all at once if None
+    :param run_names: name the runs, only used in the chunked mode where runs are otherwise only indexed
+    :return: DataArray of the perturbation_matrix, lazily loaded from the file in the chunked mode
     """
 
+    if chunk_size is not None:
+        if output_directory is None:
+            raise ValueError('output_directory is required to write the perturbations in chunks')
+        filename = write_perturbation_chunks(
+            variables,
+            Path(output_directory)
+            / f'perturbation_matrix_{len(variables)}variables_{sample_rule.value}{number_perturbations}.nc',
+            number_perturbations=number_perturbations,
+            sample_rule=sample_rule,
+            chunk_size=chunk_size,
+            run_names=run_names,
+        )
+        return xr.open_dataarray(filename)
+
     distribution = distribution_from_variables(variables)
 
     # get random samples from joint distribution
@@ -78,6 +113,317 @@ def perturb_variables(
     return perturbations
 
 
+def perturbation_chunks(
+    variables: List[PerturbedVariable],
+    number_perturbations: int = 1,
+    sample_rule: SampleRule = SampleRule.RANDOM,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Generator of the perturbations in blocks, so a large ensemble is never held in memory.
+    The blocks continue the same sequence, the KOROBOV and SOBOL blocks together are the
+    samples of perturb_variables, the RANDOM blocks continue the numpy random state.
+
+    :param variables: names of random variables we are perturbing
+    :param number_perturbations: total number of perturbations for the ensemble
+    :param sample_rule: rule for sampling the joint distribution, KOROBOV, SOBOL or RANDOM
+    :param chunk_size: number of perturbations in each block
+    :return: generator of the index of the first perturbation and the block of the perturbation matrix (perturbation x variable)
+    """
+
+    if sample_rule == SampleRule.LATINHYPERCUBE:
+        raise ValueError(f'{sample_rule} samples can not be generated in blocks')
+
+    distribution = distribution_from_variables(variables)
+    number_variables = len(variables)
+    if sample_rule == SampleRule.KOROBOV:
+        lattice = np.empty(number_variables)
+        lattice[0] = 1
+        for vdx in range(1, number_variables):
+            lattice[vdx] = KOROBOV_BASE * lattice[vdx - 1] % (number_perturbations + 1)
+    elif sample_rule == SampleRule.SOBOL:
+        import chaospy
+
+    for first in range(0, number_perturbations, chunk_size):
+        index = np.arange(first, min(first + chunk_size, number_perturbations))
+
+        # samples in the unit hypercube, then mapped into the joint distribution
+        if sample_rule == SampleRule.KOROBOV:
+            unit_sample = lattice[:, None] * (index + 1) / (number_perturbations + 1.0) % 1.0
+        elif sample_rule == SampleRule.SOBOL:
+            # the seed is the position of the first sample in the sequence, which starts at 1
+            unit_sample = chaospy.create_sobol_samples(len(index), number_variables, seed=first + 1)
+        else:
+            unit_sample = np.random.random((number_variables, len(index)))
+
+        random_sample = distribution.inv(unit_sample)
+        for vdx, variable_distribution in enumerate(distribution):
+            if variable_distribution.interpret_as_integer:
+                random_sample[vdx] = np.round(random_sample[vdx])
+
+        yield first, random_sample.T
+
+
+def write_perturbation_chunks(
+    variables: List[PerturbedVariable],
+    filename: PathLike,
+    number_perturbations: int = 1,
+    sample_rule: SampleRule = SampleRule.RANDOM,
+    chunk_size: int = CHUNK_SIZE,
+    run_names: bool = False,
+) -> Path:
+    """
+    :param variables: names of random variables we are perturbing
+    :param filename: netCDF file the blocks of the perturbation matrix are appended to
+    :param number_perturbations: total number of perturbations for the ensemble
+    :param sample_rule: rule for sampling the joint distribution, KOROBOV, SOBOL or RANDOM
+    :param chunk_size: number of perturbations in each block (and netCDF chunk)
+    :param run_names: write the run names as in perturb_variables, otherwise runs are only indexed
+    :return: name of the netCDF file
+    """
+
+    import netCDF4
+
+    variable_names = [f'{variable.name}' for variable in variables]
+    with netCDF4.Dataset(filename, 'w') as dataset:
+        dataset.createDimension('run', None)
+        dataset.createDimension('variable', len(variables))
+        variable_coordinate = dataset.createVariable('variable', str, ('variable',))
+        variable_coordinate[:] = np.array(variable_names, dtype=object)
+        perturbation_matrix = dataset.createVariable(
+            'perturbation_matrix',
+            'f8',
+            ('run', 'variable'),
+            chunksizes=(min(chunk_size, number_perturbations), len(variables)),
+        )
+        if run_names:
+            run_coordinate = dataset.createVariable('run', str, ('run',))
+
+        for first, random_sample in perturbation_chunks(
+            variables, number_perturbations, sample_rule, chunk_size
+        ):
+            last = first + len(random_sample)
+            perturbation_matrix[first:last] = random_sample
+            if run_names:
+                run_coordinate[first:last] = np.array(
+                    [
+                        f'{len(variables)}_variable_{sample_rule.value}_{index + 1}'
+                        for index in range(first, last)
+                    ],
+                    dtype=object,
+                )
+            print(f'written perturbations {first + 1} to {last} into {filename}')
+
+    return Path(filename)
+
+
+class PerturbationEncoder:
+    """
+    One-hot encoder of perturbation matrices, fit once from the list of variables:
+    the categories (scheme names) of the discrete variables, the bounds of the
+    continuous variables and the skopt space are precomputed, so any number of
+    perturbations are transformed with vectorized operations.
+    The columns are the categories of each discrete variable (sorted by scheme
+    name, as in OneHotEncoder) followed by the continuous variables.
+    """
+
+    def __init__(
+        self,
+        variables: List[PerturbedVariable],
+        categories: dict = None,
+        scale: bool = True,
+    ):
+        """
+        :param variables: PerturbedVariable classes (or names) in the order of the perturbation matrix
+        :param categories: dictionary of variable name to list of the levels to encode, all levels of the discrete variables if None
+        :param scale: scale non-categorical values to [0,1]?
+        """
+
+        self.variables = [
+            PerturbedVariable.class_from_variable_name(variable)
+            if isinstance(variable, str)
+            else variable
+            for variable in variables
+        ]
+        self.variable_names = [variable.name for variable in self.variables]
+        self.scale = scale
+
+        scheme_names = []
+        self._discrete = []  # (variable index, lookup of level - lower_bound to column)
+        self._continuous = []  # (variable index, column, lower_bound, upper_bound)
+        self._space = []
+        # columns of the parameter dictionaries of skopt: scheme name or variable name
+        self._parameter_columns = {}
+        for vdx, variable in enumerate(self.variables):
+            if variable.variable_distribution != VariableDistribution.DISCRETEUNIFORM:
+                continue
+            levels = range(variable.lower_bound, variable.upper_bound + 1)
+            if categories is not None and variable.name in categories:
+                levels = categories[variable.name]
+            schemes = sorted(variable.return_scheme_name(level) for level in levels)
+            lookup = np.full(variable.upper_bound - variable.lower_bound + 1, -1)
+            for level in range(variable.lower_bound, variable.upper_bound + 1):
+                scheme_name = variable.return_scheme_name(level)
+                if scheme_name in schemes:
+                    lookup[level - variable.lower_bound] = len(scheme_names) + schemes.index(
+                        scheme_name
+                    )
+            self._parameter_columns[variable.name] = {
+                scheme_name: len(scheme_names) + sdx for sdx, scheme_name in enumerate(schemes)
+            }
+            scheme_names += schemes
+            self._discrete.append((vdx, lookup))
+            self._space.append(('categorical', schemes, variable.name))
+
+        for vdx, variable in enumerate(self.variables):
+            if variable.variable_distribution == VariableDistribution.DISCRETEUNIFORM:
+                continue
+            self._continuous.append(
+                (vdx, len(scheme_names), variable.lower_bound, variable.upper_bound)
+            )
+            self._parameter_columns[variable.name] = (
+                len(scheme_names),
+                variable.lower_bound,
+                variable.upper_bound,
+            )
+            scheme_names.append(variable.name)
+            self._space.append(
+                ('real', (variable.lower_bound, variable.upper_bound), variable.name)
+            )
+
+        self.scheme_names = np.array(scheme_names)
+
+    @classmethod
+    def from_perturbation_matrix(
+        cls, perturbation_matrix: xr.DataArray, scale: bool = True
+    ) -> 'PerturbationEncoder':
+        """
+        :param perturbation_matrix: DataArray of the perturbation where categorical parameterizations are given in ordinal integers
+        :param scale: scale non-categorical values to [0,1]?
+        :return: encoder of the variables in the matrix, with only the levels that occur in the matrix
+        """
+
+        variable_names = list(perturbation_matrix['variable'].values)
+        categories = {}
+        for variable_name in variable_names:
+            variable = PerturbedVariable.class_from_variable_name(variable_name)
+            if variable.variable_distribution == VariableDistribution.DISCRETEUNIFORM:
+                values = perturbation_matrix.sel(variable=variable_name).values
+                categories[variable_name] = np.unique(values).astype(int).tolist()
+
+        return cls(variable_names, categories=categories, scale=scale)
+
+    @property
+    def space(self) -> List:
+        """list of skopt.space types (Categorical or Real in range) of the encoded variables"""
+        from skopt.space import Categorical, Real
+
+        return [
+            Categorical(list(bounds), name=name)
+            if kind == 'categorical'
+            else Real(*bounds, name=name)
+            for kind, bounds, name in self._space
+        ]
+
+    @property
+    def number_columns(self) -> int:
+        return len(self.scheme_names)
+
+    def transform(self, perturbation_matrix, dtype=float) -> Union[xr.DataArray, np.ndarray]:
+        """
+        :param perturbation_matrix: DataArray (run x variable), or array with the variables in the encoder order,
+            where categorical parameterizations are given in ordinal integers
+        :param dtype: data type of the transformed matrix
+        :return: transformed perturbation matrix, DataArray (run x scheme) if perturbation_matrix is a DataArray
+        """
+
+        if isinstance(perturbation_matrix, xr.DataArray):
+            values = (
+                perturbation_matrix.sel(variable=self.variable_names)
+                .transpose('run', 'variable')
+                .values
+            )
+        else:
+            values = np.asarray(perturbation_matrix)
+        if values.ndim == 1:
+            values = values.reshape(1, -1)
+
+        number_perturbations = values.shape[0]
+        variable_matrix = np.zeros((number_perturbations, self.number_columns), dtype=dtype)
+        rows = np.arange(number_perturbations)
+        for vdx, lookup in self._discrete:
+            columns = self._level_columns(values[:, vdx], vdx, lookup)
+            unknown = columns < 0
+            if unknown.any():
+                unknown_levels = np.unique(values[unknown, vdx])
+                raise ValueError(f'{self.variables[vdx].name} has unknown levels {unknown_levels}')
+            variable_matrix[rows, columns] = 1
+        for vdx, column, lower_bound, upper_bound in self._continuous:
+            pvalues = values[:, vdx]
+            if self.scale:
+                pvalues = (pvalues - lower_bound) / (upper_bound - lower_bound)
+            variable_matrix[:, column] = pvalues
+
+        if not isinstance(perturbation_matrix, xr.DataArray):
+            return variable_matrix
+
+        return xr.DataArray(
+            data=variable_matrix,
+            coords={'run': perturbation_matrix['run'].values, 'scheme': self.scheme_names},
+            dims=('run', 'scheme'),
+            name='transformed_perturbation_matrix',
+        )
+
+    def known(self, perturbation_matrix: np.ndarray) -> np.ndarray:
+        """
+        :param perturbation_matrix: array with the variables in the encoder order
+        :return: boolean mask of the perturbations with only levels in the categories of the encoder
+        """
+
+        values = np.asarray(perturbation_matrix).reshape(-1, len(self.variables))
+        known = np.ones(len(values), dtype=bool)
+        for vdx, lookup in self._discrete:
+            known &= self._level_columns(values[:, vdx], vdx, lookup) >= 0
+        return known
+
+    def _level_columns(self, levels: np.ndarray, vdx: int, lookup: np.ndarray) -> np.ndarray:
+        """
+        :param levels: levels of the discrete variable
+        :param vdx: index of the variable
+        :param lookup: lookup of level - lower_bound to column
+        :return: columns of the levels, -1 for levels that are not encoded
+        """
+
+        offsets = levels.astype(int) - self.variables[vdx].lower_bound
+        columns = lookup[np.clip(offsets, 0, len(lookup) - 1)]
+        columns[(offsets < 0) | (offsets >= len(lookup))] = -1
+        return columns
+
+    def encode_parameters(self, param_dict: dict, out: np.ndarray = None) -> np.ndarray:
+        """
+        :param param_dict: dictionary of variable name to scheme name (categorical) or value, e.g., the named arguments of a skopt objective
+        :param out: array (1 x number_columns) to write into, allocated if None
+        :return: transformed perturbation vector (1 x number_columns)
+        """
+
+        if out is None:
+            out = np.zeros((1, self.number_columns))
+        else:
+            out[:] = 0
+        for variable_name, value in param_dict.items():
+            columns = self._parameter_columns[variable_name]
+            if isinstance(columns, dict):
+                if value not in columns:
+                    raise ValueError(f'{value} is not a category of {variable_name}')
+                out[0, columns[value]] = 1
+            else:
+                column, lower_bound, upper_bound = columns
+                if self.scale:
+                    value = (value - lower_bound) / (upper_bound - lower_bound)
+                out[0, column] = value
+        return out
+
+
 def transform_perturbation_matrix(
     perturbation_matrix: xr.DataArray,
     rule: TransformRule = TransformRule.ONEHOT,
@@ -86,71 +432,25 @@ def transform_perturbation_matrix(
 ) -> Union[xr.DataArray, List]:
     """
     :param perturbation_matrix: DataArray of the perturbation where categorical parameterizations are given in ordinal integers
-    :param rule: rule for the transformation, see TransformRule class and sklearn preprocessing class. Only ONEHOT = OneHotEncoder() has been implemented.
+    :param rule: rule for the transformation, see TransformRule class and sklearn preprocessing class. Only ONEHOT (as OneHotEncoder) has been implemented.
     :param scale: scale non-categorical values to [0,1]?
     :param output_type:
         "matrix" - DataArray of transformed perturbation matrix, or
         "space"  - List of skopt.space types (Categorical or Real in range)
     :return: DataArray of the transformed perturbation_matrix
+
+    To transform many matrices with the same variables, build a PerturbationEncoder once instead.
     """
 
-    variable_names = perturbation_matrix['variable'].values
-    runs = perturbation_matrix['run'].values
-    # make the matrix for the categorical values
-    categorical_matrix = []
-    for run in runs:
-        pvalues = perturbation_matrix.sel(run=run)
-        variable_vector = []
-        num_notcat_vars = 0
-        for variable_name in variable_names:
-            variable = PerturbedVariable.class_from_variable_name(variable_name)
-            if variable.variable_distribution == VariableDistribution.DISCRETEUNIFORM:
-                scheme_name = variable.return_scheme_name(pvalues.sel(variable=variable_name))
-                variable_vector.append(scheme_name)
-            else:
-                num_notcat_vars += 1
-        categorical_matrix.append(variable_vector)
-
-    scheme_names = np.empty(0)
-    variable_matrix = np.empty(0)
-    space = []
-    # transform the categorical values if there are any
-    if len(categorical_matrix) > 0:
-        enc = rule.value
-        variable_matrix = enc.fit_transform(categorical_matrix).toarray()
-
-        for schemes in enc.categories_:
-            scheme_names = np.append(scheme_names, schemes)
-            variable = PerturbedVariable.class_from_scheme_name(schemes[0])
-            scheme_list = Categorical([scheme for scheme in schemes], name=variable.name)
-            space.append(scheme_list)
-
-    # now add on the non-categorial values if num_notcat_vars > 0
-    if num_notcat_vars > 0:
-        for variable_name in variable_names:
-            variable = PerturbedVariable.class_from_variable_name(variable_name)
-            if variable.variable_distribution != VariableDistribution.DISCRETEUNIFORM:
-                pvalues = perturbation_matrix.sel(variable=variable_name).values
-                if scale:
-                    pvalues = (pvalues - variable.lower_bound) / (
-                        variable.upper_bound - variable.lower_bound
-                    )
-                variable_matrix = np.append(variable_matrix, pvalues.reshape(-1, 1), axis=1)
-                scheme_names = np.append(scheme_names, variable_name)
-                parameter_range = Real(
-                    variable.lower_bound, variable.upper_bound, name=variable.name
-                )
-                space.append(parameter_range)
+    if rule != TransformRule.ONEHOT:
+        raise ValueError(f'{rule} not implemented')
+
+    encoder = PerturbationEncoder.from_perturbation_matrix(perturbation_matrix, scale=scale)
 
     if output_type == 'matrix':
-        return xr.DataArray(
-            data=variable_matrix,
-            coords={'run': runs, 'scheme': scheme_names},
-            dims=('run', 'scheme'),
-            name='transformed_perturbation_matrix',
-        )
+        return encoder.transform(perturbation_matrix)
     elif output_type == 'space':
-        return space
+        return encoder.space
     else:
         raise ValueError(f'{output_type} not recognized. must be "matrix" or "space"')
 
@@ -165,10 +465,9 @@ def parameter_dict_to_perturbation_vector(param_dict: dict) -> xr.DataArray:
     for vdx, var_name in enumerate(param_dict):
         variable = PerturbedVariable.class_from_variable_name(var_name)
         if variable.variable_distribution == VariableDistribution.DISCRETEUNIFORM:
-            for value in range(variable.lower_bound, variable.upper_bound + 1):
-                scheme_name = variable.return_scheme_name(value)
-                if scheme_name == param_dict[var_name]:
-                    perturbation_vector[vdx] = value
+            perturbation_vector[vdx] = PerturbedVariable.level_from_scheme_name(
+                param_dict[var_name]
+            )
         else:
             perturbation_vector[vdx] = param_dict[var_name]
 
@@ -178,3 +477,100 @@ def parameter_dict_to_perturbation_vector(param_dict: dict) -> xr.DataArray:
         dims='variable',
         name='perturbation_vector',
     )
+
+
+def select_augmentation(
+    perturbation_matrix: xr.DataArray,
+    surrogate_model: List,
+    number_selected: int,
+    number_candidates: int = 100000,
+    sample_rule: SampleRule = SampleRule.SOBOL,
+    kl_dict: dict = None,
+    batch_size: int = 10000,
+    minimum_distance: float = 0.1,
+) -> xr.DataArray:
+    """
+    Selects the next configurations to run, where the members of a surrogate ensemble
+    (e.g., the list of folds or seeds used in surrogate.utils.surrogate_model_predict)
+    disagree most. The disagreement is the variance of the member predictions, summed over
+    the KL modes weighted by their eigenvalues (the variance in the space of the outputs).
+
+    :param perturbation_matrix: DataArray of the perturbation of the runs the surrogate was trained on
+    :param surrogate_model: list of the surrogate models of the ensemble, trained on the transformed perturbation_matrix
+    :param number_selected: number of configurations to select
+    :param number_candidates: number of candidate configurations sampled with sample_rule
+    :param sample_rule: rule for sampling the candidates, see perturbation_chunks
+    :param kl_dict: dictionary of the KL decomposition if the surrogate predicts KL coefficients, the eigenvalues weight the modes
+    :param batch_size: number of candidates scored at a time
+    :param minimum_distance: minimum distance in the transformed (one-hot and scaled) space of a selected configuration to the runs and the other selections
+    :return: DataArray of the perturbation_matrix of the selected configurations, with their score
+    """
+
+    from surrogate.utils import surrogate_model_predict
+
+    if not isinstance(surrogate_model, list) or len(surrogate_model) < 2:
+        raise ValueError('surrogate_model must be a list of at least two surrogate models')
+
+    encoder = PerturbationEncoder.from_perturbation_matrix(perturbation_matrix)
+    variables = encoder.variables
+    if kl_dict is not None:
+        mode_weights = np.asarray(kl_dict['eigenvalues'], dtype=float)
+
+    # keep the highest scoring candidates of each batch
+    pool_size = CANDIDATES_PER_SELECTION * number_selected
+    pool_scores = np.empty(0)
+    pool_perturbations = np.empty((0, len(variables)))
+    for first, candidates in perturbation_chunks(
+        variables, number_candidates, sample_rule, chunk_size=batch_size
+    ):
+        # the surrogate only knows the schemes of the runs it was trained on
+        candidates = candidates[encoder.known(candidates)]
+        if len(candidates) == 0:
+            continue
+        variable_matrix = encoder.transform(candidates)
+        member_predictions = np.stack(
+            [surrogate_model_predict(member, variable_matrix) for member in surrogate_model]
+        )
+        member_variance = member_predictions.reshape(len(surrogate_model), len(candidates), -1)
+        member_variance = member_variance.var(axis=0)
+        if kl_dict is not None:
+            scores = member_variance[:, 0 : len(mode_weights)].dot(mode_weights)
+        else:
+            scores = member_variance.sum(axis=1)
+
+        pool_scores = np.concatenate([pool_scores, scores])
+        pool_perturbations = np.concatenate([pool_perturbations, candidates])
+        if len(pool_scores) > pool_size:
+            keep = np.argpartition(pool_scores, -pool_size)[-pool_size::]
+            pool_scores, pool_perturbations = pool_scores[keep], pool_perturbations[keep]
+
+    # greedy selection of the highest scores that are not too close to the runs or each other
+    order = np.argsort(pool_scores)[::-1]
+    pool_scores, pool_perturbations = pool_scores[order], pool_perturbations[order]
+    pool_matrix = encoder.transform(pool_perturbations)
+    selected_matrix = encoder.transform(perturbation_matrix).values
+    selected = []
+    for cdx in range(len(pool_scores)):
+        distance = np.sqrt(((selected_matrix - pool_matrix[cdx]) ** 2).sum(axis=1)).min()
+        if distance < minimum_distance:
+            continue
+        selected.append(cdx)
+        selected_matrix = np.vstack([selected_matrix, pool_matrix[cdx]])
+        if len(selected) == number_selected:
+            break
+    if len(selected) < number_selected:
+        print(f'only {len(selected)} candidates are at least {minimum_distance} apart')
+
+    run_names = [
+        f'{len(variables)}_variable_augmented_{index + 1}' for index in range(0, len(selected))
+    ]
+    return xr.DataArray(
+        data=pool_perturbations[selected],
+        coords={
+            'run': run_names,
+            'variable': encoder.variable_names,
+            'score': ('run', pool_scores[selected]),
+        },
+        dims=('run', 'variable'),
+        name='perturbation_matrix',
+    )
@@ -0,0 +1,345 @@
+import json
+import os
+import signal
+import subprocess
+import time
+import xarray as xr
+from abc import ABC, abstractmethod
+from os import PathLike
+from pathlib import Path
+from string import Template
+from typing import List, Union
+from wrf_fvcom.variables import (
+    PerturbedVariable,
+    VariableDistribution,
+    WRF_PBL_SFCLAY,
+    WRF_MP,
+    WRF_RA,
+    WRF_LM,
+    FVCOM_Prandtl,
+    FVCOM_SWRadiationAbsorption,
+)
+
+# WRF namelist.input options of the levels of the WRF scheme variables (see the scheme names).
+# WRF_WaterZ0 is left out as its z0 schemes are not one namelist switch shared by the surface
+# layer schemes of WRF_PBL_SFCLAY (e.g., the depth dependent z0 is shalwater_z0 = 1 of the
+# revised MM5 surface layer only), so templates choose its options from ${WRF_WaterZ0}.
+# The FVCOM schemes (FVCOM_VerticalMixing, FVCOM_WindStress) are compiler options, so they are
+# only placeholders, e.g., ${FVCOM_VerticalMixing} to choose the executable compiled with it.
+NAMELIST_OPTIONS = {
+    WRF_PBL_SFCLAY: {
+        1: {'bl_pbl_physics': 1, 'sf_sfclay_physics': 1},
+        2: {'bl_pbl_physics': 2, 'sf_sfclay_physics': 2},
+        3: {'bl_pbl_physics': 5, 'sf_sfclay_physics': 5},
+    },
+    WRF_MP: {1: {'mp_physics': 10}, 2: {'mp_physics': 8}, 3: {'mp_physics': 6}},
+    WRF_RA: {
+        1: {'ra_lw_physics': 1, 'ra_sw_physics': 3},
+        2: {'ra_lw_physics': 4, 'ra_sw_physics': 4},
+        3: {'ra_lw_physics': 5, 'ra_sw_physics': 5},
+    },
+    WRF_LM: {1: {'sf_surface_physics': 2}, 2: {'sf_surface_physics': 4}},
+}
+
+STATUS_FILENAME = 'status.json'
+
+# member states
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+MEMBER_STATES = (PENDING, RUNNING, DONE, FAILED)
+
+# file in the member directory with the exit code of the command of the member
+EXIT_FILENAME = 'member.exit'
+
+
+def member_values(perturbation_vector: Union[xr.DataArray, dict], run: str = None) -> dict:
+    """
+    :param perturbation_vector: values of the variables of one member, DataArray over variable or dictionary of variable name to value
+    :param run: name of the member
+    :return: dictionary of the template placeholders of the member: the namelist options, the level
+        (or value) of each variable by its class name (e.g., ${FVCOM_VerticalMixing} to choose the
+        executable compiled with the scheme), and the run name
+    """
+
+    if isinstance(perturbation_vector, xr.DataArray):
+        perturbation_vector = dict(
+            zip(perturbation_vector['variable'].values, perturbation_vector.values)
+        )
+
+    values = {'run': run}
+    for variable_name, value in perturbation_vector.items():
+        variable = PerturbedVariable.class_from_variable_name(variable_name)
+        if variable.variable_distribution == VariableDistribution.DISCRETEUNIFORM:
+            level = int(round(float(value)))
+            values[variable.__name__] = level
+            values.update(NAMELIST_OPTIONS.get(variable, {}).get(level, {}))
+        else:
+            values[variable.__name__] = f'{float(value):.6g}'
+
+        if variable == FVCOM_SWRadiationAbsorption:
+            values['heating_longwave_perctage'] = f'{float(value):.6g}'
+            values['heating_longwave_lengthscale'] = f'{variable.calc_Z1(float(value)):.6g}'
+            values['heating_shortwave_lengthscale'] = f'{variable.calc_Z2(float(value)):.6g}'
+        elif variable == FVCOM_Prandtl:
+            # FVCOM implements the inverse of the Prandtl number
+            values['horizontal_prandtl_number'] = f'{1 / float(value):.6g}'
+            values['vertical_prandtl_number'] = f'{1 / float(value):.6g}'
+
+    return values
+
+
+def render_members(
+    perturbation_matrix: xr.DataArray,
+    templates: dict,
+    ensemble_directory: PathLike,
+) -> List[Path]:
+    """
+    :param perturbation_matrix: DataArray of the perturbation, e.g., from wrf_fvcom.perturb.perturb_variables
+    :param templates: dictionary of the file name in the member directory (e.g., "namelist.input", "run.nml") to its
+        string.Template file, with placeholders such as ${mp_physics} or ${vertical_prandtl_number} (see member_values)
+    :param ensemble_directory: directory where the directory of each member (named by run) is made
+    :return: list of the member directories
+    """
+
+    template_text = {}
+    for filename, template_file in templates.items():
+        with open(template_file) as fp:
+            template_text[filename] = Template(fp.read())
+
+    if 'run' in perturbation_matrix.coords:
+        runs = [str(run) for run in perturbation_matrix['run'].values]
+    else:
+        runs = [f'member_{rdx + 1}' for rdx in range(perturbation_matrix.sizes['run'])]
+
+    member_directories = []
+    for rdx, run in enumerate(runs):
+        values = member_values(perturbation_matrix.isel(run=rdx), run=run)
+        member_directory = Path(ensemble_directory) / run
+        member_directory.mkdir(parents=True, exist_ok=True)
+        for filename, template in template_text.items():
+            with open(member_directory / filename, 'w') as fp:
+                fp.write(template.substitute(values))
+        with open(member_directory / 'member.json', 'w') as fp:
+            json.dump(values, fp, indent=1)
+        member_directories.append(member_directory)
+
+    print(f'rendered {len(member_directories)} members into {ensemble_directory}')
+    return member_directories
+
+
+class SchedulerBackend(ABC):
+    """
+    Backend that runs the command of a member, e.g., on the local machine or by
+    submitting to a batch system, and reports the state of the job.
+    """
+
+    @abstractmethod
+    def submit(self, member_directory: Path, command: str):
+        """
+        :param member_directory: directory of the member, where the command runs
+        :param command: command to run
+        :return: job identifier, saved in the status file
+        """
+
+    @abstractmethod
+    def poll(self, job) -> str:
+        """
+        :param job: job identifier from submit
+        :return: RUNNING, DONE or FAILED
+        """
+
+    @abstractmethod
+    def cancel(self, job):
+        """
+        :param job: job identifier from submit
+        """
+
+
+class LocalSubprocessBackend(SchedulerBackend):
+    """
+    Runs the members as subprocesses on the local machine, with the output in member.log
+    and the exit code in EXIT_FILENAME, so a restarted scheduler gets the result of the members
+    that ended while it was stopped
+    """
+
+    def __init__(self):
+        self._processes = {}
+
+    def submit(self, member_directory, command):
+        member_directory = Path(member_directory)
+        # the exit code of a previous attempt
+        (member_directory / EXIT_FILENAME).unlink(missing_ok=True)
+        # the exit code is written to a temporary file and moved, so it is never read partially
+        wrapped_command = (
+            f'(\n{command}\n)\n'
+            f'exit_code=$?\n'
+            f'echo $exit_code > {EXIT_FILENAME}.tmp && mv {EXIT_FILENAME}.tmp {EXIT_FILENAME}\n'
+            f'exit $exit_code'
+        )
+        with open(member_directory / 'member.log', 'w') as log:
+            process = subprocess.Popen(
+                wrapped_command,
+                shell=True,
+                cwd=member_directory,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                start_new_session=True,
+            )
+        self._processes[process.pid] = process
+        return {'pid': process.pid, 'directory': str(member_directory.resolve())}
+
+    def poll(self, job):
+        process = self._processes.get(job['pid'])
+        if process is not None:
+            return_code = process.poll()
+            if return_code is None:
+                return RUNNING
+            return DONE if return_code == 0 else FAILED
+
+        # not started by this backend (e.g., before a restart of the scheduler)
+        exit_file = Path(job['directory']) / EXIT_FILENAME
+        if exit_file.exists():
+            return DONE if int(exit_file.read_text()) == 0 else FAILED
+        if _member_process_exists(job):
+            return RUNNING
+        # ended without its exit code, e.g., killed
+        return FAILED
+
+    def cancel(self, job):
+        process = self._processes.get(job['pid'])
+        running = _member_process_exists(job) if process is None else process.poll() is None
+        if running:
+            # the session of the member, so the command is terminated with the shell that runs it
+            try:
+                os.killpg(job['pid'], signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+def _member_process_exists(job: dict) -> bool:
+    """
+    :param job: job identifier from LocalSubprocessBackend.submit
+    :return: the process of the job exists, where /proc is available also checking that it runs
+        in the member directory, so a process that reused the process id is not taken for the member
+    """
+
+    try:
+        os.kill(job['pid'], 0)
+    except (ProcessLookupError, PermissionError):
+        return False
+    try:
+        return Path(os.readlink(f'/proc/{job["pid"]}/cwd')) == Path(job['directory']).resolve()
+    except OSError:
+        return True
+
+
+class EnsembleScheduler:
+    """
+    Keeps up to max_concurrent members of the ensemble running through the backend,
+    and records the state of every member in the status file of the ensemble directory,
+    so a restarted scheduler does not run the members that are done again.
+    """
+
+    def __init__(
+        self,
+        backend: SchedulerBackend,
+        member_directories: List[PathLike],
+        command: str,
+        max_concurrent: int = 4,
+        status_filename: PathLike = None,
+    ):
+        """
+        :param backend: backend that runs the members
+        :param member_directories: directories of the members, e.g., from render_members
+        :param command: string.Template of the command that runs a member, rendered with the values in member.json
+        :param max_concurrent: maximum number of members running at the same time
+        :param status_filename: status file, STATUS_FILENAME in the parent of the first member directory if None
+        """
+
+        self.backend = backend
+        self.member_directories = [Path(directory) for directory in member_directories]
+        self.command = Template(command)
+        self.max_concurrent = max_concurrent
+        if status_filename is None:
+            status_filename = self.member_directories[0].parent / STATUS_FILENAME
+        self.status_filename = Path(status_filename)
+
+        self.status = {
+            str(directory): {'state': PENDING, 'job': None} for directory in self.member_directories
+        }
+        if self.status_filename.exists():
+            with open(self.status_filename) as fp:
+                saved_status = json.load(fp)
+            # members that were running when the scheduler stopped are polled with their job
+            self.status.update(
+                {
+                    directory: member_status
+                    for directory, member_status in saved_status.items()
+                    if directory in self.status
+                }
+            )
+
+    def members(self, state: str) -> List[str]:
+        """
+        :param state: PENDING, RUNNING, DONE or FAILED
+        :return: member directories in the state
+        """
+        return [directory for directory, status in self.status.items() if status['state'] == state]
+
+    def step(self) -> dict:
+        """
+        updates the state of the running members and submits pending members up to max_concurrent
+
+        :return: number of members in each state
+        """
+
+        for directory in self.members(RUNNING):
+            self.status[directory]['state'] = self.backend.poll(self.status[directory]['job'])
+
+        for directory in self.members(PENDING)[
+            0 : max(self.max_concurrent - len(self.members(RUNNING)), 0)
+        ]:
+            with open(Path(directory) / 'member.json') as fp:
+                values = json.load(fp)
+            job = self.backend.submit(Path(directory), self.command.substitute(values))
+            self.status[directory] = {'state': RUNNING, 'job': job}
+
+        self._write_status()
+        return {state: len(self.members(state)) for state in MEMBER_STATES}
+
+    def run(self, poll_interval: float = 60, retry_failed: bool = False) -> dict:
+        """
+        :param poll_interval: seconds between the updates of the member states
+        :param retry_failed: submit the members that failed again, once
+        :return: number of members in each state when no member is pending or running
+        """
+
+        if retry_failed:
+            for directory in self.members(FAILED):
+                self.status[directory] = {'state': PENDING, 'job': None}
+
+        while True:
+            counts = self.step()
+            print(f'ensemble status: {counts}')
+            if counts[PENDING] == 0 and counts[RUNNING] == 0:
+                return counts
+            time.sleep(poll_interval)
+
+    def cancel(self):
+        """cancels the running members, which are pending again"""
+
+        for directory in self.members(RUNNING):
+            self.backend.cancel(self.status[directory]['job'])
+            self.status[directory] = {'state': PENDING, 'job': None}
+        self._write_status()
+
+    def _write_status(self):
+        """writes the status file atomically so an interruption leaves the previous status"""
+
+        temporary_file = self.status_filename.with_suffix('.json.tmp')
+        with open(temporary_file, 'w') as fp:
+            json.dump(self.status, fp, indent=1)
+        os.replace(temporary_file, self.status_filename)
@@ -1,17 +1,48 @@
-import chaospy
-import pint
+from __future__ import annotations
+
 from abc import ABC
 from enum import Enum
-from typing import Union
-from pint import Quantity
+from typing import TYPE_CHECKING, Union
+
+if TYPE_CHECKING:
+    import chaospy
+    import pint
+    from pint import Quantity
+
+# pint unit registry, created when first used (see unit_registry)
+_units = None
 
-units = pint.UnitRegistry()
+# registries of the PerturbedVariable classes, filled when the classes are defined:
+# variable name -> class, scheme name -> (class, level) and (class, level) -> scheme name
+VARIABLE_REGISTRY = {}
+SCHEME_REGISTRY = {}
+LEVEL_REGISTRY = {}
+
+
+def unit_registry() -> pint.UnitRegistry:
+    """
+    :return: pint unit registry, created on the first call as it takes a while
+    """
+    global _units
+    if _units is None:
+        import pint
+
+        _units = pint.UnitRegistry()
+    return _units
+
+
+def __getattr__(name):
+    # the unit registry is still available as wrf_fvcom.variables.units
+    if name == 'units':
+        return unit_registry()
+    raise AttributeError(f'module {__name__} has no attribute {name}')
 
 
 class VariableDistribution(Enum):
-    GAUSSIAN = chaospy.Normal
-    UNIFORM = chaospy.Uniform
-    DISCRETEUNIFORM = chaospy.DiscreteUniform
+    # names of the chaospy distributions, which are imported when a distribution is made
+    GAUSSIAN = 'Normal'
+    UNIFORM = 'Uniform'
+    DISCRETEUNIFORM = 'DiscreteUniform'
 
 
 class Variable(ABC):
@@ -28,10 +59,12 @@ class Variable(ABC):
 
     @unit.setter
     def unit(self, unit: Union[str, pint.Unit]):
+        import pint
+
         if not isinstance(unit, pint.Unit):
             if unit is None:
                 unit = ""
-            unit = units.Unit(unit)
+            unit = unit_registry().Unit(unit)
         self.__unit = unit
 
 
@@ -49,6 +82,8 @@ class PerturbedVariable(Variable, ABC):
 
     @classmethod
     def chaospy_distribution(self, normalize: bool = False) -> chaospy.Distribution:
+        import chaospy
+
         if self.variable_distribution == VariableDistribution.GAUSSIAN:
             if normalize:
                 distribution = chaospy.Normal(mu=0.0, sigma=1.0)
@@ -71,48 +106,70 @@ class PerturbedVariable(Variable, ABC):
 
         return distribution
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # concrete variables register themselves when they are defined
+        if 'name' in cls.__dict__:
+            cls.register()
+
+    @classmethod
+    def register(cls):
+        """adds the variable and its schemes to the registry of the lookups by name"""
+
+        VARIABLE_REGISTRY[cls.name] = cls
+        if cls.variable_distribution == VariableDistribution.DISCRETEUNIFORM:
+            for level in range(cls.lower_bound, cls.upper_bound + 1):
+                scheme_name = cls.return_scheme_name(level)
+                SCHEME_REGISTRY[scheme_name] = (cls, level)
+                LEVEL_REGISTRY[(cls, level)] = scheme_name
+        else:
+            SCHEME_REGISTRY[cls.name] = (cls, None)
+
     @classmethod
     def class_from_variable_name(self, name):
-        variable_classes = [
-            WRF_PBL_SFCLAY,
-            WRF_WaterZ0,
-            WRF_MP,
-            WRF_RA,
-            WRF_LM,
-            FVCOM_WindStress,
-            FVCOM_VerticalMixing,
-            FVCOM_Prandtl,
-            FVCOM_SWRadiationAbsorption,
-        ]
-        for variable_class in variable_classes:
-            if variable_class.name == name:
-                return variable_class
-        raise ValueError(f'{name} not recognized')
+        try:
+            return VARIABLE_REGISTRY[_registry_key(name)]
+        except KeyError:
+            raise ValueError(f'{name} not recognized')
 
     @classmethod
     def class_from_scheme_name(self, name):
-        variable_classes = [
-            WRF_PBL_SFCLAY,
-            WRF_WaterZ0,
-            WRF_MP,
-            WRF_RA,
-            WRF_LM,
-            FVCOM_WindStress,
-            FVCOM_VerticalMixing,
-            FVCOM_Prandtl,
-            FVCOM_SWRadiationAbsorption,
-        ]
-        for variable_class in variable_classes:
-            if variable_class.variable_distribution == VariableDistribution.DISCRETEUNIFORM:
-                for value in range(variable_class.lower_bound, variable_class.upper_bound + 1):
-                    scheme_name = variable_class.return_scheme_name(value)
-                    if scheme_name == name:
-                        return variable_class
-            else:
-                if variable_class.name == name:
-                    return variable_class
+        try:
+            return SCHEME_REGISTRY[_registry_key(name)][0]
+        except KeyError:
+            raise ValueError(f'{name} not recognized')
 
-        raise ValueError(f'{name} not recognized')
+    @classmethod
+    def level_from_scheme_name(self, name) -> int:
+        """
+        :param name: scheme name of a discrete variable
+        :return: level (integer option) of the scheme
+        """
+        try:
+            return SCHEME_REGISTRY[_registry_key(name)][1]
+        except KeyError:
+            raise ValueError(f'{name} not recognized')
+
+    @classmethod
+    def scheme_name_from_level(cls, level) -> str:
+        """
+        :param level: level (integer option) of the discrete variable
+        :return: scheme name of the level
+        """
+        try:
+            return LEVEL_REGISTRY[(cls, int(level))]
+        except KeyError:
+            raise ValueError(f'{level} is not a level of {cls.name}')
+
+
+def _registry_key(name) -> str:
+    """
+    :param name: variable or scheme name, also as a scalar DataArray or array (e.g., looping over a coordinate)
+    :return: name as a string key
+    """
+    if not isinstance(name, str):
+        name = name.item()
+    return name
 
 
 class WRF_PBL_SFCLAY(PerturbedVariable):